@@ -12,7 +12,11 @@ except Exception:
 ROOT_DIR = Path(__file__).resolve().parents[1]
 ARTIFACTS_DIR = ROOT_DIR / "artifacts"
 DB_PATH = ARTIFACTS_DIR / "db" / "evidence.jsonl"
+SQLITE_PATH = ARTIFACTS_DIR / "db" / "evidence.sqlite3"
+SEGMENTS_DIR = ARTIFACTS_DIR / "db" / "segments"
+ZDICT_DIR = ARTIFACTS_DIR / "db" / "zdict"
 COMPARE_DIR = ARTIFACTS_DIR / "compare"
+OCR_CACHE_DIR = ARTIFACTS_DIR / "ocr_cache"
 
 # === Обязательные переменные ===
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")  # must be set
@@ -23,6 +27,73 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")          # must be set
 OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
 MODEL_REASONING = os.environ.get("MODEL_REASONING", "gpt-5")
 MODEL_FRIENDLY  = os.environ.get("MODEL_FRIENDLY", "gpt-5-chat")
+# Хранилище evidence: "jsonl" (DB_PATH), "sqlite" (SQLITE_PATH, WAL)
+# или "segmented" (SEGMENTS_DIR, ротация + компакция)
+EVIDENCE_BACKEND = os.environ.get("EVIDENCE_BACKEND", "jsonl").lower()
+# Чтение JSONL: "index" (sidecar .idx) или "mmap" (скан с байтовым префильтром)
+EVIDENCE_READ_MODE = os.environ.get("EVIDENCE_READ_MODE", "index").lower()
+# Дедупликация фрагментов по sha256 (blobs/ рядом с хранилищем)
+EVIDENCE_BLOBS = os.environ.get("EVIDENCE_BLOBS", "true").lower() in ("1", "true", "yes")
+EVIDENCE_BLOB_MIN_BYTES = int(os.environ.get("EVIDENCE_BLOB_MIN_BYTES", "256"))
+# Сжатие блобов: "none" | "zlib" | "lzma"; EVIDENCE_ZDICT — id словаря zlib
+# (python -m bot.evidence_codec train). Чтение понимает все форматы.
+EVIDENCE_COMPRESS = os.environ.get("EVIDENCE_COMPRESS", "none").lower()
+EVIDENCE_COMPRESS_MIN_BYTES = int(os.environ.get("EVIDENCE_COMPRESS_MIN_BYTES", "1024"))
+EVIDENCE_ZDICT = os.environ.get("EVIDENCE_ZDICT", "")
+# LRU-кэш загруженных дел (0 — выключен) и его TTL
+EVIDENCE_CACHE_CASES = int(os.environ.get("EVIDENCE_CACHE_CASES", "256"))
+EVIDENCE_CACHE_TTL_S = float(os.environ.get("EVIDENCE_CACHE_TTL_S", "600"))
+SEGMENT_MAX_BYTES = int(os.environ.get("SEGMENT_MAX_BYTES", str(16 * 1024 * 1024)))
+SEGMENT_MAX_AGE_S = float(os.environ.get("SEGMENT_MAX_AGE_S", str(24 * 3600)))
+COMPACT_INTERVAL_S = float(os.environ.get("COMPACT_INTERVAL_S", "3600"))  # 0 — не компактировать
+# Фоновая запись evidence: "message" (каждое сообщение ждёт записи),
+# "interval" (пачка раз в EVIDENCE_FLUSH_MS, без ожидания), "fsync" (ждёт fsync)
+EVIDENCE_FLUSH = os.environ.get("EVIDENCE_FLUSH", "message").lower()
+EVIDENCE_FLUSH_MS = int(os.environ.get("EVIDENCE_FLUSH_MS", "50"))
+# OCR в пуле процессов: число воркеров и максимум задач (в работе + в очереди)
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+OCR_QUEUE_MAX = int(os.environ.get("OCR_QUEUE_MAX", "16"))
+# страниц одного PDF в пуле одновременно; tesseract'ов всего — не больше OCR_WORKERS
+OCR_PAGE_WORKERS = int(os.environ.get("OCR_PAGE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# кэш OCR по sha256 загрузки (0 — выключен)
+OCR_CACHE_MAX_MB = int(os.environ.get("OCR_CACHE_MAX_MB", "256"))
+# Большие PDF: не больше OCR_MAX_PAGES страниц (0 — все), растр страницы для OCR —
+# не больше OCR_MAX_PIXELS (A4 при 300 DPI — около 8.7 Мп)
+OCR_MAX_PAGES = int(os.environ.get("OCR_MAX_PAGES", "100"))
+OCR_MAX_PIXELS = int(os.environ.get("OCR_MAX_PIXELS", str(12_000_000)))
+# Выборочный OCR (bot/ocr_select.py): текстовый слой с долей мусора выше OCR_GARBAGE_MAX
+# или с покрытием глифами ниже OCR_MIN_COVERAGE — OCR всей страницы; картинки без
+# текста поверх площадью от OCR_MIN_REGION страницы — OCR только их
+OCR_GARBAGE_MAX = float(os.environ.get("OCR_GARBAGE_MAX", "0.25"))
+OCR_MIN_COVERAGE = float(os.environ.get("OCR_MIN_COVERAGE", "0.1"))
+OCR_MIN_REGION = float(os.environ.get("OCR_MIN_REGION", "0.02"))
+# Движок OCR: "pytesseract" (процесс tesseract на вызов), "tesserocr" (libtesseract
+# в процессе, модели загружены один раз) или "auto" — tesserocr, если установлен
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto").lower()
+# Предобработка перед OCR: серый, уменьшение до OCR_TARGET_DPI (PDF рендерится сразу в нём);
+# бинаризация и выравнивание — для перечисленных источников: photo, image, pdf
+OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", "true").lower() in ("1", "true", "yes")
+OCR_TARGET_DPI = int(os.environ.get("OCR_TARGET_DPI", "300"))
+OCR_BINARIZE = {s.strip() for s in os.environ.get("OCR_BINARIZE", "photo").split(",") if s.strip()}
+OCR_DESKEW = {s.strip() for s in os.environ.get("OCR_DESKEW", "photo").split(",") if s.strip()}
+# Один язык tesseract на страницу, если письменность явно одна (bot/ocr_lang.py):
+# доля букв по текстовому слою и минимальная уверенность OSD
+OCR_SCRIPT_DETECT = os.environ.get("OCR_SCRIPT_DETECT", "true").lower() in ("1", "true", "yes")
+OCR_SCRIPT_MIN_SHARE = float(os.environ.get("OCR_SCRIPT_MIN_SHARE", "0.98"))
+OCR_SCRIPT_MIN_CONF = float(os.environ.get("OCR_SCRIPT_MIN_CONF", "2.0"))
+# OSD для страниц без текстового слоя: он видит одну доминирующую письменность, и русский
+# бланк ушёл бы в "rus" без латиницы (WBC, mmol/L) — по умолчанию такие страницы идут с OCR_LANG
+OCR_SCRIPT_OSD = os.environ.get("OCR_SCRIPT_OSD", "false").lower() in ("1", "true", "yes")
+# HTTP к модели (bot/llm_http.py): общий пул соединений с keep-alive
+# (LLM_MAX_KEEPALIVE=0 — соединение на запрос, как раньше), HTTP/2 — если установлен h2,
+# таймауты в секундах, прокси (по умолчанию — из HTTPS_PROXY)
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", str(LLM_MAX_CONNECTIONS)))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "30"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "10"))
+LLM_PROXY = os.environ.get("LLM_PROXY") or os.environ.get("HTTPS_PROXY") or ""
 DEBUG = os.environ.get("DEBUG", "false").lower() in ("1", "true", "yes")
 
 # создать директории
@@ -0,0 +1,158 @@
+# bot/evidence_codec.py
+"""Сжатие блобов evidence (крупные OCR-фрагменты).
+
+Формат блоба на диске:
+  * без заголовка — обычный UTF-8 текст (старые блобы и мелкие фрагменты);
+  * b"\\0z" + zlib-поток;
+  * b"\\0d" + 16 байт id словаря + zlib-поток со словарём (zdict);
+  * b"\\0x" + xz (lzma).
+Текст OCR не начинается с NUL, так что заголовок однозначен.
+
+Словарь — байтовая строка частых фрагментов наших лабораторных бланков;
+лежит в ZDICT_DIR/<id>.bin, id = первые 16 hex sha256. Обучение:
+
+    python -m bot.evidence_codec train --blobs artifacts/db/blobs
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import lzma
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from bot import config
+
+METHODS = ("none", "zlib", "lzma")
+
+_TAG_ZLIB = b"\0z"
+_TAG_ZDICT = b"\0d"
+_TAG_LZMA = b"\0x"
+
+ZDICT_MAX_BYTES = 32 * 1024  # больше zlib всё равно не использует (окно 32K)
+
+_DICTS: Dict[str, bytes] = {}
+
+
+def dict_id(zdict: bytes) -> str:
+    return hashlib.sha256(zdict).hexdigest()[:16]
+
+
+def load_dict(did: str, root: Path | None = None) -> bytes:
+    zd = _DICTS.get(did)
+    if zd is None:
+        zd = _DICTS[did] = ((root or config.ZDICT_DIR) / f"{did}.bin").read_bytes()
+    return zd
+
+
+def save_dict(zdict: bytes, root: Path | None = None) -> str:
+    did = dict_id(zdict)
+    root = root or config.ZDICT_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    (root / f"{did}.bin").write_bytes(zdict)
+    _DICTS[did] = zdict
+    return did
+
+
+def train_dict(samples: Iterable[str], max_bytes: int = ZDICT_MAX_BYTES) -> bytes:
+    """Собирает словарь из частых 1–4-словных последовательностей образцов.
+
+    zlib дешевле ссылается на конец словаря, поэтому самые частые — в конце.
+    """
+    counts: Counter = Counter()
+    for text in samples:
+        words = text.split()
+        for n in (1, 2, 3, 4):
+            for i in range(len(words) - n + 1):
+                counts[" ".join(words[i : i + n])] += 1
+    # выигрыш ~ длина * (частота - 1): одиночные вхождения бесполезны
+    scored = sorted(
+        ((len(s.encode("utf-8")) * (c - 1), s) for s, c in counts.items() if c > 1),
+        reverse=True,
+    )
+    picked, size = [], 0
+    for _, s in scored:
+        b = (s + " ").encode("utf-8")
+        if size + len(b) > max_bytes:
+            continue
+        picked.append(b)
+        size += len(b)
+    return b"".join(reversed(picked))
+
+
+class BlobCodec:
+    def __init__(
+        self,
+        method: str | None = None,
+        level: int | None = None,
+        zdict: str | None = None,
+        min_bytes: int | None = None,
+    ):
+        self.method = (method or config.EVIDENCE_COMPRESS).lower()
+        if self.method not in METHODS:
+            raise ValueError(f"Unknown compression method: {self.method!r} (expected one of {METHODS})")
+        self.level = level
+        self.zdict_id = config.EVIDENCE_ZDICT if zdict is None else zdict
+        self.min_bytes = config.EVIDENCE_COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+
+    def encode(self, data: bytes) -> bytes:
+        if self.method == "none" or len(data) < self.min_bytes:
+            return data
+        if self.method == "lzma":
+            out = _TAG_LZMA + lzma.compress(data, preset=6 if self.level is None else self.level)
+        elif self.zdict_id:
+            c = zlib.compressobj(level=9 if self.level is None else self.level,
+                                 zdict=load_dict(self.zdict_id))
+            out = _TAG_ZDICT + self.zdict_id.encode("ascii") + c.compress(data) + c.flush()
+        else:
+            out = _TAG_ZLIB + zlib.compress(data, 9 if self.level is None else self.level)
+        return out if len(out) < len(data) else data
+
+    @staticmethod
+    def decode(payload: bytes) -> bytes:
+        tag = payload[:2]
+        if tag == _TAG_ZLIB:
+            return zlib.decompress(payload[2:])
+        if tag == _TAG_ZDICT:
+            did = payload[2:18].decode("ascii")
+            d = zlib.decompressobj(zdict=load_dict(did))
+            return d.decompress(payload[18:]) + d.flush()
+        if tag == _TAG_LZMA:
+            return lzma.decompress(payload[2:])
+        return payload
+
+
+_DEFAULT: Optional[BlobCodec] = None
+
+
+def default_codec() -> BlobCodec:
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = BlobCodec()
+    return _DEFAULT
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Evidence blob compression tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    tr = sub.add_parser("train", help="train a zlib dictionary from existing blobs")
+    tr.add_argument("--blobs", type=Path, default=config.DB_PATH.parent / "blobs")
+    tr.add_argument("--limit", type=int, default=2000, help="max blobs to sample")
+    args = ap.parse_args()
+
+    samples = []
+    for p in sorted(args.blobs.rglob("*")):
+        if p.is_file() and not p.name.endswith(".tmp"):
+            samples.append(BlobCodec.decode(p.read_bytes()).decode("utf-8", "replace"))
+            if len(samples) >= args.limit:
+                break
+    if not samples:
+        raise SystemExit(f"No blobs found under {args.blobs}")
+    did = save_dict(train_dict(samples))
+    print(f"Done. Dictionary {did} from {len(samples)} blobs -> {config.ZDICT_DIR / (did + '.bin')}\n"
+          f"Enable with EVIDENCE_COMPRESS=zlib EVIDENCE_ZDICT={did}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# bot/evidence_compact.py
+"""Компакция сегментированного лога evidence (EVIDENCE_BACKEND=segmented).
+
+    python -m bot.evidence_compact [--dir artifacts/db/segments] [--rotate]
+
+В боте та же компакция крутится фоном раз в COMPACT_INTERVAL_S (см. compactor_loop).
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+from bot import config
+from .evidence_io import SegmentedEvidenceStore, get_store
+
+log = logging.getLogger("evidence_compact")
+
+
+async def compactor_loop(store: SegmentedEvidenceStore, interval_s: float | None = None) -> None:
+    """Периодически запечатывает активный сегмент по возрасту и компактирует запечатанные."""
+    interval = config.COMPACT_INTERVAL_S if interval_s is None else interval_s
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(store.rotate_if_due)
+            stats = await asyncio.to_thread(store.compact)
+            if stats["segments_in"]:
+                log.info("evidence compaction: %s", stats)
+        except Exception as e:
+            log.exception("evidence compaction failed: %s", e)
+
+
+def main(argv: list[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description="Compact the segmented evidence log")
+    ap.add_argument("--dir", type=Path, default=config.SEGMENTS_DIR)
+    ap.add_argument("--rotate", action="store_true", help="seal the active segment first")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    store = get_store(args.dir, backend="segmented", raw=True)  # обёртки кэша/блобов не умеют rotate/compact
+    if args.rotate:
+        store.rotate()
+    print(json.dumps(store.compact(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,26 @@
 from __future__ import annotations
 import json
-from dataclasses import dataclass, asdict
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только между потоками
+    fcntl = None
+
 from bot import config
+from bot.utils import normalize_text, sha256_of
+from bot.evidence_codec import BlobCodec, default_codec
 
-@dataclass
+@dataclass(slots=True)
 class Evidence:
     case_id: str
     user_id: int
@@ -14,29 +29,1198 @@ class Evidence:
     source: dict  # {type, file_name?, page?, bbox?, hash?, note?}
     created_at: str
 
+    def __post_init__(self):
+        # роль и source.type — из маленького словаря, интернируем
+        self.role = sys.intern(self.role)
+        t = self.source.get("type") if isinstance(self.source, dict) else None
+        if type(t) is str:
+            self.source["type"] = sys.intern(t)
+
+    def to_dict(self) -> dict:
+        return {
+            "case_id": self.case_id,
+            "user_id": self.user_id,
+            "role": self.role,
+            "fragment": self.fragment,
+            "source": self.source,
+            "created_at": self.created_at,
+        }
+
     def to_json(self) -> str:
-        return json.dumps(asdict(self), ensure_ascii=False)
+        return _ENCODER.encode(self.to_dict())
 
 
-def append_evidence(records: Iterable[Evidence], db_path: Path | None = None) -> None:
-    db = db_path or config.DB_PATH
-    db.parent.mkdir(parents=True, exist_ok=True)
-    with db.open("a", encoding="utf-8") as f:
-        for r in records:
-            f.write(r.to_json() + "\n")
+# ---------------- Codec ----------------
+#
+# Без asdict (он глубоко копирует source на каждую запись) и без лишних
+# пробелов в разделителях. Формат строки — тот же JSON-объект, старые логи
+# читаются как есть.
 
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
 
-def load_evidence(case_id: str, user_id: int, db_path: Path | None = None) -> List[Evidence]:
-    db = db_path or config.DB_PATH
-    out: List[Evidence] = []
-    if not db.exists():
-        return out
-    with db.open("r", encoding="utf-8") as f:
-        for line in f:
+
+def encode_lines(records: Iterable[Evidence]) -> List[bytes]:
+    """По строке JSONL (с "\n") на запись — длины нужны индексу смещений."""
+    enc = _ENCODER.encode
+    return [(enc(r.to_dict()) + "\n").encode("utf-8") for r in records]
+
+
+def encode_batch(records: Iterable[Evidence]) -> bytes:
+    return b"".join(encode_lines(records))
+
+
+def decode_row(row: dict) -> Evidence:
+    return Evidence(row["case_id"], row["user_id"], row["role"], row["fragment"],
+                    row["source"], row["created_at"])
+
+
+def decode_rows(lines: List[bytes]) -> List[dict]:
+    """Декодирует пачку строк одним json.loads; битые строки пропускает."""
+    if not lines:
+        return []
+    try:
+        return json.loads(b"[" + b",".join(lines) + b"]")
+    except Exception:
+        rows = []
+        for line in lines:
             try:
-                row = json.loads(line)
+                rows.append(json.loads(line))
             except Exception:
                 continue
+        return rows
+
+
+# ---------------- Offset index ----------------
+#
+# Рядом с логом лежит `<log>.idx` — append-only JSONL из строк
+# [case_id, user_id, offset, length]. В памяти держим словарь
+# (case_id, user_id) -> array("Q") [offset, length, offset, length, ...],
+# чтобы load_evidence читал только строки своего дела, а не декодировал весь лог.
+#
+# Переигрывать весь .idx при холодном старте не быстрее полного скана лога,
+# поэтому рядом периодически пишется `<log>.idx.snap`: JSON-заголовок (ключи,
+# число записей у каждого, до какого байта .idx он доведён) и одним блоком
+# байты всех массивов. Старт = снимок + JSON-хвост .idx после него.
+
+INDEX_SUFFIX = ".idx"
+SNAPSHOT_SUFFIX = ".idx.snap"
+LOCK_SUFFIX = ".lock"
+SNAPSHOT_EVERY = 1 << 20  # байт .idx сверх снимка, после которых он переписывается
+
+Key = Tuple[str, int]
+
+
+def index_path_for(db: Path) -> Path:
+    return db.with_name(db.name + INDEX_SUFFIX)
+
+
+def snapshot_path_for(db: Path) -> Path:
+    return db.with_name(db.name + SNAPSHOT_SUFFIX)
+
+
+class FileLock:
+    """Межпроцессная advisory-блокировка (flock на <log>.lock) поверх потокового RLock.
+
+    Реентерабельна в пределах потока. Без fcntl (Windows) — только RLock.
+    Файл можно удалить, держа блокировку (unlink): взявший flock после этого
+    видит, что его inode уже не лежит по пути, и блокирует новый файл.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> "FileLock":
+        self._rlock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fd = self._flock()
+            except BaseException:
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def _flock(self) -> int:
+        while True:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                        return fd
+                except FileNotFoundError:
+                    pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)  # файл удалили, пока ждали, — берём заново
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+    def unlink(self) -> None:
+        """Удаляет файл блокировки, держа её (лог, который она защищала, уже удалён)."""
+        with self:
+            self.path.unlink(missing_ok=True)
+
+
+class OffsetIndex:
+    """Индекс смещений одного лога.
+
+    Все операции — под FileLock лога, так что несколько процессов (реплики
+    бота, regress рядом с ботом) видят один и тот же .idx: перед записью
+    процесс дочитывает строки индекса, добавленные другими, и только потом
+    индексирует хвост лога — каждый диапазон лога попадает в .idx один раз.
+    """
+
+    def __init__(self, db: Path):
+        self.db = db
+        self.path = index_path_for(db)
+        self.snap_path = snapshot_path_for(db)
+        self.covered = 0  # байт лога, уже учтённых в индексе
+        self.offsets: Dict[Key, array] = {}
+        self._last: Optional[Tuple[Key, int, int]] = None
+        self._idx_pos = 0  # сколько байт .idx уже прочитано
+        self._idx_ino: Optional[int] = None
+        self._snap_pos = 0  # до какого байта .idx доведён снимок на диске
+        self.lock = FileLock(db.with_name(db.name + LOCK_SUFFIX))
+
+    # --- загрузка / проверка ---
+
+    def _reset(self) -> None:
+        self.covered = 0
+        self.offsets = {}
+        self._last = None
+        self._idx_pos = 0
+        self._idx_ino = None
+        self._snap_pos = 0
+
+    def _remember(self, key: Key, off: int, n: int) -> None:
+        arr = self.offsets.get(key)
+        if arr is None:
+            arr = self.offsets[key] = array("Q")
+        arr.append(off)
+        arr.append(n)
+        self._last = (key, off, n)
+        if off + n > self.covered:
+            self.covered = off + n
+
+    def _load_snapshot(self, st: os.stat_result) -> bool:
+        """Состояние из .idx.snap, если он снят с этого же .idx; False — снимка нет или он чужой."""
+        try:
+            with self.snap_path.open("rb") as f:
+                head = json.loads(f.readline())
+                body = f.read()
+            if (head.get("v") != 1 or head["byteorder"] != sys.byteorder
+                    or head["ino"] != st.st_ino or head["pos"] > st.st_size):
+                return False
+            flat = array("Q")
+            flat.frombytes(body)
+            if len(flat) != 2 * sum(k[2] for k in head["keys"]) or not self._snapshot_matches_idx(head):
+                return False
+        except Exception:
+            return False
+        offsets: Dict[Key, array] = {}
+        i = 0
+        for case_id, user_id, count in head["keys"]:
+            offsets[(case_id, user_id)] = flat[i:i + 2 * count]
+            i += 2 * count
+        self.offsets = offsets
+        self.covered = head["covered"]
+        last = head["last"]
+        self._last = ((last[0], last[1]), last[2], last[3]) if last else None
+        self._idx_ino = st.st_ino
+        self._idx_pos = self._snap_pos = head["pos"]
+        return True
+
+    def _snapshot_matches_idx(self, head: dict) -> bool:
+        """Строка .idx перед head["pos"] — последняя запись снимка (номер inode мог достаться новому .idx)."""
+        pos = head["pos"]
+        if pos == 0:
+            return head["last"] is None
+        with self.path.open("rb") as f:
+            f.seek(max(0, pos - 4096))
+            tail = f.read(pos - max(0, pos - 4096))
+        if not tail.endswith(b"\n"):
+            return False
+        return json.loads(tail[:-1].rsplit(b"\n", 1)[-1]) == head["last"]
+
+    def _write_snapshot(self) -> None:
+        keys = list(self.offsets.items())
+        last = self._last
+        head = {
+            "v": 1, "byteorder": sys.byteorder, "ino": self._idx_ino, "pos": self._idx_pos,
+            "covered": self.covered,
+            "last": [last[0][0], last[0][1], last[1], last[2]] if last else None,
+            "keys": [[k[0], k[1], len(a) // 2] for k, a in keys],
+        }
+        tmp = self.snap_path.with_name(self.snap_path.name + ".tmp")
+        with tmp.open("wb") as f:
+            f.write(json.dumps(head, ensure_ascii=False).encode("utf-8") + b"\n")
+            for _, a in keys:
+                a.tofile(f)
+        os.replace(tmp, self.snap_path)
+        self._snap_pos = self._idx_pos
+
+    def _maybe_snapshot(self) -> None:
+        if self._idx_ino is not None and self._idx_pos - self._snap_pos >= SNAPSHOT_EVERY:
+            try:
+                self._write_snapshot()
+            except OSError:
+                pass  # снимок — только ускорение старта
+
+    def _read_new_entries(self) -> None:
+        """Дочитывает строки .idx, дописанные с прошлого раза (в т.ч. другими процессами)."""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            if self._idx_ino is not None:
+                self._reset()  # индекс удалили — перестраиваем из лога
+            return
+        if st.st_ino != self._idx_ino or st.st_size < self._idx_pos:
+            self._reset()
+            if not self._load_snapshot(st):
+                self._idx_ino = st.st_ino
+        if st.st_size == self._idx_pos:
+            return
+        try:
+            with self.path.open("rb") as f:
+                f.seek(self._idx_pos)
+                data = f.read()
+            if not data.endswith(b"\n"):
+                raise ValueError("truncated index line")
+            # строки .idx — JSON без переводов строк внутри: весь хвост одним json.loads
+            for case_id, user_id, off, n in json.loads(b"[" + data[:-1].replace(b"\n", b",") + b"]"):
+                self._remember((case_id, user_id), off, n)
+            self._idx_pos += len(data)
+        except Exception:
+            self._rebuild()
+
+    def _is_consistent(self, size: int) -> bool:
+        """Лог не укоротился и последняя запись индекса указывает на ту же строку."""
+        if size < self.covered:
+            return False
+        if self._last is None:
+            return True
+        key, off, n = self._last
+        try:
+            with self.db.open("rb") as f:
+                f.seek(off)
+                row = json.loads(f.read(n))
+        except Exception:
+            return False
+        return (row.get("case_id"), row.get("user_id")) == key
+
+    def _rebuild(self) -> None:
+        self._reset()
+        self.path.unlink(missing_ok=True)
+        self.snap_path.unlink(missing_ok=True)
+
+    def _scan_tail(self, size: int) -> None:
+        """Индексирует полные строки лога начиная с self.covered."""
+        entries: List[Tuple[Key, int, int]] = []
+        with self.db.open("rb") as f:
+            f.seek(self.covered)
+            off = self.covered
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # оборванная строка (упавший писатель) — её закроет следующий append
+                n = len(line)
+                try:
+                    row = json.loads(line)
+                    entries.append(((row.get("case_id"), row.get("user_id")), off, n))
+                except Exception:
+                    pass
+                off += n
+        for key, o, n in entries:
+            self._remember(key, o, n)
+        self._write_entries(entries)
+        # битые строки тоже считаем пройденными
+        self.covered = max(self.covered, off)
+
+    def _write_entries(self, entries: List[Tuple[Key, int, int]]) -> None:
+        if not entries:
+            return
+        with self.path.open("ab") as f:
+            f.write("".join(
+                json.dumps([k[0], k[1], o, n], ensure_ascii=False) + "\n"
+                for k, o, n in entries
+            ).encode("utf-8"))
+            f.flush()
+            st = os.fstat(f.fileno())
+        self._idx_ino = st.st_ino
+        self._idx_pos = st.st_size
+
+    def sync(self) -> None:
+        """Приводит индекс в соответствие с логом: дочитывает .idx, проверяет, доиндексирует хвост."""
+        with self.lock:
+            self._read_new_entries()
+            size = self.db.stat().st_size if self.db.exists() else 0
+            if not self._is_consistent(size):
+                self._rebuild()
+            if size > self.covered:
+                self._scan_tail(size)
+            self._maybe_snapshot()
+
+    def forget(self) -> None:
+        """Сбрасывает состояние в памяти; следующий sync() перечитает .idx с диска."""
+        with self.lock:
+            self._reset()
+
+    # --- публичные операции ---
+
+    def add(self, entries: List[Tuple[Key, int, int]]) -> None:
+        with self.lock:
+            for key, off, n in entries:
+                self._remember(key, off, n)
+            self._write_entries(entries)
+            self._maybe_snapshot()
+
+    def lookup(self, case_id: str, user_id: int) -> List[Tuple[int, int]]:
+        with self.lock:
+            self.sync()
+            arr = self.offsets.get((case_id, user_id))
+            return list(zip(arr[::2], arr[1::2])) if arr else []
+
+
+_INDEXES: Dict[Path, OffsetIndex] = {}
+
+
+def get_index(db: Path) -> OffsetIndex:
+    db = Path(os.path.abspath(db))
+    idx = _INDEXES.get(db)
+    if idx is None:
+        idx = _INDEXES[db] = OffsetIndex(db)
+    return idx
+
+
+def drop_index(db: Path) -> None:
+    """Забывает индекс удалённого лога и удаляет .idx, снимок и .lock.
+
+    .lock удаляется под самой блокировкой: процесс, ждавший flock на старом
+    файле, после этого перепроверит inode (FileLock._flock), так что блокировки
+    не разойдутся, а файлы .lock выброшенных сегментов не копятся.
+    """
+    db = Path(os.path.abspath(db))
+    idx = _INDEXES.pop(db, None)
+    with idx.lock if idx else FileLock(db.with_name(db.name + LOCK_SUFFIX)) as lock:
+        index_path_for(db).unlink(missing_ok=True)
+        snapshot_path_for(db).unlink(missing_ok=True)
+        lock.unlink()
+
+
+# ---------------- Stores ----------------
+
+class EvidenceStore:
+    """Интерфейс хранилища evidence: append + выборка по (case_id, user_id)."""
+
+    def append(self, records: Iterable[Evidence], durable: bool = False) -> None:
+        """durable=True — дождаться fsync перед возвратом."""
+        raise NotImplementedError
+
+    def load(self, case_id: str, user_id: int) -> List[Evidence]:
+        return list(self.iter_case(case_id, user_id))
+
+    def iter_case(
+        self,
+        case_id: str,
+        user_id: int,
+        roles: Collection[str] | None = None,
+        since: str | None = None,
+    ) -> Iterator[Evidence]:
+        """Записи дела по порядку; roles/since (ISO, включительно) — фильтры."""
+        for e in self.load(case_id, user_id):
+            if _wanted(e.role, e.created_at, roles, since):
+                yield e
+
+    def close(self) -> None:
+        pass
+
+
+def _wanted(role: str, created_at: str, roles: Collection[str] | None, since: str | None) -> bool:
+    if roles is not None and role not in roles:
+        return False
+    return since is None or created_at >= since
+
+
+def mmap_scan(db: Path, case_id: str, user_id: int) -> Iterator[dict]:
+    """Скан лога через mmap: ищем байты `"<case_id>"` и декодируем только эти строки."""
+    if not db.exists() or db.stat().st_size == 0:
+        return
+    needle = json.dumps(case_id, ensure_ascii=False).encode("utf-8")
+    with db.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(needle)
+        while pos != -1:
+            start = mm.rfind(b"\n", 0, pos) + 1
+            end = mm.find(b"\n", pos)
+            if end == -1:
+                break  # недописанная последняя строка
+            try:
+                row = json.loads(mm[start:end])
+            except Exception:
+                row = None
+            if row and row.get("case_id") == case_id and row.get("user_id") == user_id:
+                yield row
+            pos = mm.find(needle, end)
+
+
+def _ends_torn(db: Path, size: int) -> bool:
+    with db.open("rb") as f:
+        f.seek(size - 1)
+        return f.read(1) != b"\n"
+
+
+class JsonlEvidenceStore(EvidenceStore):
+    """Append-only JSONL. Чтение: по индексу смещений (см. OffsetIndex) или,
+    в режиме read_mode="mmap", сканом с байтовым префильтром (см. mmap_scan).
+    """
+
+    def __init__(self, path: Path, read_mode: str | None = None):
+        self.path = Path(path)
+        self.read_mode = (read_mode or config.EVIDENCE_READ_MODE).lower()
+
+    def append(self, records: Iterable[Evidence], durable: bool = False) -> None:
+        db = self.path
+        db.parent.mkdir(parents=True, exist_ok=True)
+        idx = get_index(db)
+        entries: List[Tuple[Key, int, int]] = []
+        with idx.lock:
+            idx.sync()
+            recs = list(records)
+            lines = encode_lines(recs)
+            with db.open("ab") as f:
+                off = f.seek(0, os.SEEK_END)
+                if off and idx.covered < off and _ends_torn(db, off):
+                    f.write(b"\n")  # закрываем строку, оборванную упавшим писателем
+                    off += 1
+                f.write(b"".join(lines))
+                for r, line in zip(recs, lines):
+                    entries.append(((r.case_id, r.user_id), off, len(line)))
+                    off += len(line)
+                if durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            idx.add(entries)
+
+    def _rows(self, case_id: str, user_id: int) -> Iterator[dict]:
+        db = self.path
+        if not db.exists():
+            return
+        if self.read_mode == "mmap":
+            yield from mmap_scan(db, case_id, user_id)
+            return
+        with db.open("rb") as f:
+            lines = []
+            for off, n in get_index(db).lookup(case_id, user_id):
+                f.seek(off)
+                lines.append(f.read(n))
+        for row in decode_rows(lines):
             if row.get("case_id") == case_id and row.get("user_id") == user_id:
-                out.append(Evidence(**row))
-    return out
\ No newline at end of file
+                yield row
+
+    def iter_case(self, case_id, user_id, roles=None, since=None) -> Iterator[Evidence]:
+        for row in self._rows(case_id, user_id):
+            if _wanted(row.get("role"), row.get("created_at"), roles, since):
+                yield decode_row(row)
+
+    def scan(self) -> Iterator[dict]:
+        """Все валидные строки лога по порядку (для миграции/обслуживания)."""
+        if not self.path.exists():
+            return
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except Exception:
+                    continue
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS evidence (
+    id         INTEGER PRIMARY KEY,
+    case_id    TEXT    NOT NULL,
+    user_id    INTEGER NOT NULL,
+    role       TEXT    NOT NULL,
+    fragment   TEXT    NOT NULL,
+    source     TEXT    NOT NULL,
+    created_at TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_evidence_case ON evidence(case_id, user_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_evidence_role ON evidence(role);
+"""
+
+
+class SqliteEvidenceStore(EvidenceStore):
+    """SQLite в режиме WAL: индексированное чтение, читатели не блокируют писателя.
+
+    Соединение своё на каждый поток (sqlite3 не любит делить их между потоками).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SQLITE_SCHEMA)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def append(self, records: Iterable[Evidence], durable: bool = False) -> None:
+        rows = [
+            (r.case_id, r.user_id, r.role, r.fragment,
+             json.dumps(r.source, ensure_ascii=False), r.created_at)
+            for r in records
+        ]
+        if not rows:
+            return
+        conn = self._conn()
+        if durable:
+            # в WAL с synchronous=NORMAL коммит не fsync'ается — включаем на время записи
+            conn.execute("PRAGMA synchronous=FULL")
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO evidence (case_id, user_id, role, fragment, source, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        finally:
+            if durable:
+                conn.execute("PRAGMA synchronous=NORMAL")
+
+    def iter_case(self, case_id, user_id, roles=None, since=None) -> Iterator[Evidence]:
+        sql = ("SELECT case_id, user_id, role, fragment, source, created_at FROM evidence "
+               "WHERE case_id = ? AND user_id = ?")
+        args: list = [case_id, user_id]
+        if since is not None:
+            sql += " AND created_at >= ?"
+            args.append(since)
+        if roles is not None:
+            roles = list(roles)
+            sql += f" AND role IN ({', '.join('?' * len(roles))})"
+            args.extend(roles)
+        cur = self._conn().execute(sql + " ORDER BY id", args)
+        for c, u, r, fr, src, ts in cur:
+            yield Evidence(c, u, r, fr, json.loads(src), ts)
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM evidence").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+# ---------------- Segmented log ----------------
+#
+# Каталог с сегментами seg-NNNNNN.jsonl (у каждого свой OffsetIndex) и
+# manifest.json. Пишем только в активный сегмент; по размеру/возрасту он
+# запечатывается, и в манифест попадает список его case_id — чтение идёт
+# только по сегментам, где дело встречается. Запечатанные сегменты не
+# меняются (инкрементальные бэкапы), кроме как при compact().
+
+MANIFEST_NAME = "manifest.json"
+
+
+def is_noise_row(row: dict) -> bool:
+    """Записи, которые компактор выбрасывает: тестовые и команды, попавшие в patient_text."""
+    if (row.get("source") or {}).get("type") == "test":
+        return True
+    frag = str(row.get("fragment") or "").lstrip()
+    return row.get("role") == "patient_text" and frag.startswith("/")
+
+
+# роли с исходным содержимым дела; lab/system — производные от него
+CONTENT_ROLES = frozenset({"patient_text", "ocr"})
+
+
+class SegmentedEvidenceStore(EvidenceStore):
+    def __init__(self, root: Path, max_bytes: int | None = None, max_age_s: float | None = None):
+        self.root = Path(root)
+        self.manifest_path = self.root / MANIFEST_NAME
+        self.max_bytes = config.SEGMENT_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_age_s = config.SEGMENT_MAX_AGE_S if max_age_s is None else max_age_s
+        self.lock = threading.RLock()
+        self._manifest: Optional[dict] = None
+        self._cases: Dict[str, frozenset] = {}
+        self._compacting = threading.Lock()
+
+    # --- манифест ---
+
+    @property
+    def manifest(self) -> dict:
+        if self._manifest is None:
+            if self.manifest_path.exists():
+                self._manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            else:
+                self._manifest = {"version": 1, "next_id": 1, "active": None,
+                                  "active_opened_at": None, "sealed": []}
+        return self._manifest
+
+    def _save_manifest(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
+
+    def _new_name(self) -> str:
+        m = self.manifest
+        name = f"seg-{m['next_id']:06d}.jsonl"
+        m["next_id"] += 1
+        return name
+
+    def _cases_of(self, seg: dict) -> frozenset:
+        cases = self._cases.get(seg["name"])
+        if cases is None:
+            cases = self._cases[seg["name"]] = frozenset(seg["cases"])
+        return cases
+
+    # --- сегменты ---
+
+    def _describe(self, name: str, compacted: bool) -> dict:
+        path = self.root / name
+        idx = get_index(path)
+        idx.sync()
+        keys = idx.offsets
+        return {
+            "name": name,
+            "bytes": path.stat().st_size if path.exists() else 0,
+            "records": sum(len(v) for v in keys.values()) // 2,
+            "cases": sorted({k[0] for k in keys}),
+            "compacted": compacted,
+        }
+
+    def _should_rotate(self) -> bool:
+        m = self.manifest
+        path = self.root / m["active"]
+        size = path.stat().st_size if path.exists() else 0
+        if size == 0:
+            return False
+        if self.max_bytes and size >= self.max_bytes:
+            return True
+        opened = m.get("active_opened_at") or time.time()
+        return bool(self.max_age_s) and time.time() - opened >= self.max_age_s
+
+    def rotate(self) -> None:
+        """Запечатывает активный сегмент (если в нём что-то есть)."""
+        with self.lock:
+            m = self.manifest
+            if not m["active"]:
+                return
+            seg = self._describe(m["active"], compacted=False)
+            if seg["records"]:
+                m["sealed"].append(seg)
+            else:
+                (self.root / m["active"]).unlink(missing_ok=True)
+                drop_index(self.root / m["active"])
+            m["active"] = None
+            m["active_opened_at"] = None
+            self._save_manifest()
+
+    def rotate_if_due(self) -> None:
+        with self.lock:
+            if self.manifest["active"] and self._should_rotate():
+                self.rotate()
+
+    def _active_path(self) -> Path:
+        m = self.manifest
+        if m["active"] and self._should_rotate():
+            self.rotate()
+        if not m["active"]:
+            m["active"] = self._new_name()
+            m["active_opened_at"] = time.time()
+            self._save_manifest()
+        return self.root / m["active"]
+
+    # --- EvidenceStore ---
+
+    def append(self, records: Iterable[Evidence], durable: bool = False) -> None:
+        recs = list(records)
+        if not recs:
+            return
+        with self.lock:
+            JsonlEvidenceStore(self._active_path()).append(recs, durable=durable)
+
+    def load(self, case_id: str, user_id: int) -> List[Evidence]:
+        with self.lock:
+            m = self.manifest
+            names = [s["name"] for s in m["sealed"] if case_id in self._cases_of(s)]
+            if m["active"]:
+                names.append(m["active"])
+            out: List[Evidence] = []
+            for name in names:
+                out.extend(JsonlEvidenceStore(self.root / name).load(case_id, user_id))
+            return out
+
+    # --- компакция ---
+
+    def compact(self, drop: Callable[[dict], bool] = is_noise_row) -> dict:
+        """Переупаковывает ещё не компактированные запечатанные сегменты.
+
+        Записи группируются по делу (порядок внутри дела сохраняется), шум по
+        `drop` выбрасывается, дела без оставшихся записей исчезают целиком.
+        Осиротевшие дела — только производные записи (lab/system), без текста
+        пациента и файлов ни здесь, ни в других сегментах — выбрасываются тоже.
+        Тяжёлая часть идёт без self.lock — запись и чтение не блокируются.
+        """
+        with self._compacting:
+            with self.lock:
+                m = self.manifest
+                targets = [s for s in m["sealed"] if not s.get("compacted")]
+                names = {s["name"] for s in targets}
+                # дела, у которых есть записи вне компактируемых сегментов, сиротами не считаем
+                elsewhere = set().union(*(self._cases_of(s) for s in m["sealed"] if s["name"] not in names))
+                if m["active"]:
+                    idx = get_index(self.root / m["active"])
+                    idx.sync()
+                    elsewhere.update(k[0] for k in idx.offsets)
+            stats = {"segments_in": len(targets), "segments_out": 0, "records_in": 0,
+                     "records_out": 0, "cases_dropped": 0, "cases_orphaned": 0}
+            if not targets:
+                return stats
+
+            groups: Dict[Key, List[str]] = {}
+            seen: set = set()
+            has_content: set = set()
+            for seg in targets:
+                with (self.root / seg["name"]).open("r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            row = json.loads(line)
+                        except Exception:
+                            continue
+                        stats["records_in"] += 1
+                        key = (row.get("case_id"), row.get("user_id"))
+                        seen.add(key)
+                        if drop(row):
+                            continue
+                        if row.get("role") in CONTENT_ROLES:
+                            has_content.add(key)
+                        groups.setdefault(key, []).append(line if line.endswith("\n") else line + "\n")
+            stats["cases_dropped"] = len(seen) - len(groups)
+            for key in [k for k in groups if k not in has_content and k[0] not in elsewhere]:
+                del groups[key]
+                stats["cases_orphaned"] += 1
+
+            # пишем новые сегменты, не разрывая дело между сегментами
+            new_names: List[str] = []
+            out = None
+            size = 0
+            try:
+                for lines in groups.values():
+                    chunk = "".join(lines).encode("utf-8")
+                    if out is None or (self.max_bytes and size and size + len(chunk) > self.max_bytes):
+                        if out is not None:
+                            out.close()
+                        with self.lock:
+                            new_names.append(self._new_name())
+                            self._save_manifest()
+                        out = (self.root / new_names[-1]).open("wb")
+                        size = 0
+                    out.write(chunk)
+                    size += len(chunk)
+                    stats["records_out"] += len(lines)
+                if out is not None:
+                    out.flush()
+                    os.fsync(out.fileno())
+            finally:
+                if out is not None:
+                    out.close()
+            new_segs = [self._describe(n, compacted=True) for n in new_names]
+
+            with self.lock:
+                m = self.manifest
+                gone = {s["name"] for s in targets}
+                m["sealed"] = (
+                    [s for s in m["sealed"] if s.get("compacted")]
+                    + new_segs
+                    + [s for s in m["sealed"] if not s.get("compacted") and s["name"] not in gone]
+                )
+                self._save_manifest()
+                for name in gone:
+                    self._cases.pop(name, None)
+                    (self.root / name).unlink(missing_ok=True)
+                    drop_index(self.root / name)
+            stats["segments_out"] = len(new_segs)
+            return stats
+
+
+# ---------------- Content-addressed fragments ----------------
+#
+# Крупные фрагменты (и страницы, на которые ссылается полный текст PDF)
+# лежат один раз в blobs/<sha[:2]>/<sha>; в строке evidence остаётся
+# fragment="" и source["blob"]=sha. Полный текст PDF хранится как
+# source["parts"]=[sha страниц] — fragment восстанавливается склейкой.
+
+def blob_key(text: str) -> str:
+    return sha256_of(text.encode("utf-8"))
+
+
+def join_parts(texts: Iterable[str]) -> str:
+    return normalize_text(" ".join(texts))
+
+
+class BlobStore:
+    """Блобы по sha256 исходного текста; на диске — в формате BlobCodec (сжатые или нет)."""
+
+    def __init__(self, root: Path, codec: BlobCodec | None = None):
+        self.root = Path(root)
+        self.codec = codec or default_codec()
+
+    def path(self, h: str) -> Path:
+        return self.root / h[:2] / h
+
+    def has(self, h: str) -> bool:
+        return self.path(h).exists()
+
+    def put(self, h: str, data: bytes, durable: bool = False) -> bool:
+        """Пишет блоб, если его ещё нет. Возвращает True, если записали."""
+        p = self.path(h)
+        if p.exists():
+            return False
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f"{h}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(self.codec.encode(data))
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, p)
+        return True
+
+    def get(self, h: str) -> Optional[str]:
+        try:
+            return self.codec.decode(self.path(h).read_bytes()).decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+
+class DedupEvidenceStore(EvidenceStore):
+    """Выносит фрагменты в BlobStore при записи и подставляет их обратно при чтении."""
+
+    def __init__(self, inner: EvidenceStore, blobs: BlobStore, min_bytes: int | None = None):
+        self.inner = inner
+        self.blobs = blobs
+        self.min_bytes = config.EVIDENCE_BLOB_MIN_BYTES if min_bytes is None else min_bytes
+        self.blobs_written = 0
+        self.blobs_reused = 0
+
+    def _stripped(self, r: Evidence, **extra) -> Evidence:
+        return Evidence(r.case_id, r.user_id, r.role, "", {**r.source, **extra}, r.created_at)
+
+    def append(self, records: Iterable[Evidence], durable: bool = False) -> None:
+        recs = list(records)
+        parts_of = lambda r: r.source.get("parts") if isinstance(r.source, dict) else None
+        referenced = {h for r in recs for h in (parts_of(r) or ())}
+        texts: Dict[str, str] = {}
+        out: List[Evidence] = []
+        for r in recs:
+            if parts_of(r):
+                out.append(r)  # разберём вторым проходом, когда страницы уже в блобах
+                continue
+            data = r.fragment.encode("utf-8")
+            # страницы документа всегда в блобах: полный текст может сослаться на них
+            # позже, отдельной записью (потоковая загрузка PDF)
+            is_page = isinstance(r.source, dict) and "page" in r.source
+            h = sha256_of(data) if (len(data) >= self.min_bytes or referenced or is_page) else None
+            if h is not None and len(data) < self.min_bytes and h not in referenced and not is_page:
+                h = None  # мелкий фрагмент, на который никто не ссылается, — остаётся в строке
+            if h is None:
+                out.append(r)
+                continue
+            if self.blobs.put(h, data, durable=durable):
+                self.blobs_written += 1
+            else:
+                self.blobs_reused += 1
+            texts[h] = r.fragment
+            out.append(self._stripped(r, blob=h))
+        for i, r in enumerate(out):
+            parts = parts_of(r)
+            if not parts or r.fragment == "":
+                continue
+            part_texts = [texts.get(h) or self.blobs.get(h) for h in parts]
+            if all(t is not None for t in part_texts) and join_parts(part_texts) == r.fragment:
+                out[i] = self._stripped(r)
+            else:
+                src = {k: v for k, v in r.source.items() if k != "parts"}
+                out[i] = Evidence(r.case_id, r.user_id, r.role, r.fragment, src, r.created_at)
+        self.inner.append(out, durable=durable)
+
+    def _resolve(self, e: Evidence, memo: Dict[str, Optional[str]]) -> Evidence:
+        src = e.source if isinstance(e.source, dict) else {}
+        if e.fragment or not ("blob" in src or "parts" in src):
+            return e
+
+        def text(h: str) -> str:
+            if h not in memo:
+                memo[h] = self.blobs.get(h)
+            return memo[h] or ""
+
+        frag = text(src["blob"]) if "blob" in src else join_parts(text(h) for h in src["parts"])
+        return Evidence(e.case_id, e.user_id, e.role, frag, src, e.created_at)
+
+    def load(self, case_id: str, user_id: int) -> List[Evidence]:
+        memo: Dict[str, Optional[str]] = {}
+        return [self._resolve(e, memo) for e in self.inner.load(case_id, user_id)]
+
+    def iter_case(self, case_id, user_id, roles=None, since=None) -> Iterator[Evidence]:
+        memo: Dict[str, Optional[str]] = {}
+        for e in self.inner.iter_case(case_id, user_id, roles=roles, since=since):
+            yield self._resolve(e, memo)
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+# ---------------- Per-case cache ----------------
+
+class CachedEvidenceStore(EvidenceStore):
+    """LRU-кэш загруженных дел поверх любого хранилища.
+
+    Ограничен числом дел и TTL (TTL страхует от записей других процессов).
+    append() пишет в хранилище и дописывает записи в уже закэшированные дела,
+    так что повторный /review не перечитывает лог.
+    """
+
+    def __init__(self, inner: EvidenceStore, max_cases: int | None = None, ttl_s: float | None = None):
+        self.inner = inner
+        self.max_cases = config.EVIDENCE_CACHE_CASES if max_cases is None else max_cases
+        self.ttl_s = config.EVIDENCE_CACHE_TTL_S if ttl_s is None else ttl_s
+        self._lock = threading.Lock()
+        self._cases: "OrderedDict[Key, Tuple[float, List[Evidence]]]" = OrderedDict()
+        # дела, которые сейчас грузятся; True — пока грузили, была запись
+        self._loading: Dict[Key, bool] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def append(self, records: Iterable[Evidence], durable: bool = False) -> None:
+        recs = list(records)
+        self.inner.append(recs, durable=durable)
+        with self._lock:
+            for r in recs:
+                key = (r.case_id, r.user_id)
+                hit = self._cases.get(key)
+                if hit is not None:
+                    if not r.fragment and isinstance(r.source, dict) and "parts" in r.source:
+                        # текст — ссылками на блобы, склеит только хранилище: дело перечитаем
+                        del self._cases[key]
+                    else:
+                        hit[1].append(r)
+                if key in self._loading:
+                    self._loading[key] = True
+
+    def _hit(self, key: Key, now: float) -> Optional[List[Evidence]]:
+        """Копия живой записи кэша или None (с учётом TTL); вызывать под self._lock."""
+        hit = self._cases.get(key)
+        if hit is not None:
+            if not self.ttl_s or now - hit[0] < self.ttl_s:
+                self._cases.move_to_end(key)
+                self.hits += 1
+                return list(hit[1])
+            del self._cases[key]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def _put(self, key: Key, now: float, evs: List[Evidence]) -> None:
+        """Кладёт прочитанное дело в кэш, если за время чтения в него не писали."""
+        with self._lock:
+            if self._loading.pop(key, False):
+                return  # прочитали до параллельной записи — не кэшируем
+            self._cases[key] = (now, list(evs))
+            self._cases.move_to_end(key)
+            while len(self._cases) > self.max_cases:
+                self._cases.popitem(last=False)
+                self.evictions += 1
+
+    def load(self, case_id: str, user_id: int) -> List[Evidence]:
+        key = (case_id, user_id)
+        now = time.monotonic()
+        with self._lock:
+            evs = self._hit(key, now)
+            if evs is not None:
+                return evs
+            self._loading[key] = False
+        try:
+            evs = self.inner.load(case_id, user_id)
+        except BaseException:
+            with self._lock:
+                self._loading.pop(key, None)
+            raise
+        self._put(key, now, evs)
+        return evs
+
+    def iter_case(self, case_id, user_id, roles=None, since=None) -> Iterator[Evidence]:
+        """Дело в кэше — из него; иначе потоком из хранилища, попутно заполняя кэш.
+
+        Читается всё дело (фильтры — уже здесь), чтобы следующий /review попал
+        в кэш; чтение, брошенное на середине, в кэш не попадает.
+        """
+        key = (case_id, user_id)
+        now = time.monotonic()
+        with self._lock:
+            evs = self._hit(key, now)
+            if evs is None:
+                self._loading[key] = False
+        if evs is None:
+            evs = []
+            done = False
+            try:
+                for e in self.inner.iter_case(case_id, user_id):
+                    evs.append(e)
+                    if _wanted(e.role, e.created_at, roles, since):
+                        yield e
+                done = True
+            finally:
+                if done:
+                    self._put(key, now, evs)
+                else:
+                    with self._lock:
+                        self._loading.pop(key, None)
+            return
+        for e in evs:
+            if _wanted(e.role, e.created_at, roles, since):
+                yield e
+
+    def invalidate(self, case_id: str | None = None, user_id: int | None = None) -> None:
+        with self._lock:
+            if case_id is None:
+                self._cases.clear()
+            else:
+                self._cases.pop((case_id, user_id), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "cases": len(self._cases),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def close(self) -> None:
+        self.invalidate()
+        self.inner.close()
+
+
+BACKENDS = {
+    "jsonl": JsonlEvidenceStore,
+    "sqlite": SqliteEvidenceStore,
+    "segmented": SegmentedEvidenceStore,
+}
+
+_SQLITE_SUFFIXES = {".sqlite", ".sqlite3", ".db"}
+
+_STORES: Dict[Tuple[str, Path], EvidenceStore] = {}
+_WRAPPED: Dict[Tuple[str, Path], EvidenceStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def _default_path(backend: str) -> Path:
+    return {"sqlite": config.SQLITE_PATH, "segmented": config.SEGMENTS_DIR}.get(backend, config.DB_PATH)
+
+
+def blobs_dir_for(path: Path, backend: str) -> Path:
+    """blobs/ рядом с файлом хранилища (или внутри каталога сегментов)."""
+    return (path if backend == "segmented" else path.parent) / "blobs"
+
+
+def get_store(
+    db_path: Path | None = None,
+    backend: str | None = None,
+    raw: bool = False,
+) -> EvidenceStore:
+    """Хранилище по пути/бэкенду; по умолчанию — config.EVIDENCE_BACKEND.
+
+    Явный db_path с расширением .sqlite/.sqlite3/.db открывается SQLite-бэкендом,
+    каталог — сегментированным логом, остальное — JSONL. Бэкенд обёрнут в
+    DedupEvidenceStore (EVIDENCE_BLOBS) и CachedEvidenceStore
+    (EVIDENCE_CACHE_CASES > 0); raw=True отдаёт тот же бэкенд без обёрток.
+    """
+    if backend is None:
+        if db_path is not None:
+            p = Path(db_path)
+            if p.suffix in _SQLITE_SUFFIXES:
+                backend = "sqlite"
+            elif p.is_dir():
+                backend = "segmented"
+            else:
+                backend = "jsonl"
+        else:
+            backend = config.EVIDENCE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown evidence backend: {backend!r} (expected one of {sorted(BACKENDS)})")
+    path = Path(os.path.abspath(db_path or _default_path(backend)))
+    key = (backend, path)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = BACKENDS[backend](path)
+        if raw:
+            return store
+        wrapped = _WRAPPED.get(key)
+        if wrapped is None:
+            wrapped = store
+            if config.EVIDENCE_BLOBS:
+                wrapped = DedupEvidenceStore(wrapped, BlobStore(blobs_dir_for(path, backend)))
+            if config.EVIDENCE_CACHE_CASES > 0:
+                wrapped = CachedEvidenceStore(wrapped)
+            _WRAPPED[key] = wrapped
+        return wrapped
+
+
+# ---------------- Public API ----------------
+
+def append_evidence(records: Iterable[Evidence], db_path: Path | None = None, durable: bool = False) -> None:
+    get_store(db_path).append(records, durable=durable)
+
+
+def load_evidence(case_id: str, user_id: int, db_path: Path | None = None) -> List[Evidence]:
+    return get_store(db_path).load(case_id, user_id)
+
+
+def iter_evidence(
+    case_id: str,
+    user_id: int,
+    roles: Collection[str] | None = None,
+    since: str | None = None,
+    db_path: Path | None = None,
+) -> Iterator[Evidence]:
+    """Потоковый вариант load_evidence с фильтрами по роли и created_at >= since."""
+    return get_store(db_path).iter_case(case_id, user_id, roles=roles, since=since)
+
+
+def scan_evidence(case_id: str, user_id: int, db_path: Path | None = None) -> List[Evidence]:
+    """Полный проход по JSONL-логу без индекса (эталон для проверок и бенчмарков)."""
+    store = JsonlEvidenceStore(db_path or config.DB_PATH)
+    return [
+        decode_row(row) for row in store.scan()
+        if row.get("case_id") == case_id and row.get("user_id") == user_id
+    ]
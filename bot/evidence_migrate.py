@@ -0,0 +1,49 @@
+# bot/evidence_migrate.py
+"""Одноразовый перенос artifacts/db/evidence.jsonl в SQLite-хранилище.
+
+    python -m bot.evidence_migrate [--src evidence.jsonl] [--dst evidence.sqlite3] [--force]
+"""
+from __future__ import annotations
+import argparse
+import logging
+from pathlib import Path
+
+from bot import config
+from .evidence_io import JsonlEvidenceStore, SqliteEvidenceStore, decode_row
+from .utils import chunks
+
+log = logging.getLogger("evidence_migrate")
+
+_FIELDS = ("case_id", "user_id", "role", "fragment", "source", "created_at")
+
+
+def migrate_jsonl_to_sqlite(src: Path, dst: Path, force: bool = False, batch: int = 1000) -> int:
+    """Копирует все валидные строки src в dst. Возвращает число перенесённых записей."""
+    target = SqliteEvidenceStore(dst)
+    try:
+        if target.count() and not force:
+            raise RuntimeError(f"{dst} is not empty; use --force to append anyway")
+        n = 0
+        rows = (row for row in JsonlEvidenceStore(src).scan() if all(k in row for k in _FIELDS))
+        for part in chunks(rows, batch):
+            target.append([decode_row(row) for row in part])
+            n += len(part)
+        return n
+    finally:
+        target.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Import evidence.jsonl into the SQLite evidence store")
+    ap.add_argument("--src", type=Path, default=config.DB_PATH)
+    ap.add_argument("--dst", type=Path, default=config.SQLITE_PATH)
+    ap.add_argument("--force", action="store_true", help="append even if the target already has rows")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    n = migrate_jsonl_to_sqlite(args.src, args.dst, force=args.force)
+    log.info("migrated %d records %s -> %s", n, args.src, args.dst)
+    print(f"Done. {n} records -> {args.dst} (set EVIDENCE_BACKEND=sqlite to use it)")
+
+
+if __name__ == "__main__":
+    main()
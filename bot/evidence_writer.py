@@ -0,0 +1,165 @@
+# bot/evidence_writer.py
+"""Фоновая (group-commit) запись evidence, чтобы хендлеры aiogram не делали
+блокирующий open/write/close прямо в event loop.
+
+Хендлеры кладут записи в очередь; один поток забирает всё накопившееся и
+пишет одной пачкой через EvidenceStore. Режимы (config.EVIDENCE_FLUSH):
+  * "message"  — write() ждёт, пока его пачка записана;
+  * "interval" — write() возвращается сразу, поток копит записи EVIDENCE_FLUSH_MS;
+  * "fsync"    — как "message", но с fsync до подтверждения.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from bot import config
+from .evidence_io import Evidence, EvidenceStore, get_store
+
+log = logging.getLogger("evidence_writer")
+
+MODES = ("message", "interval", "fsync")
+
+_STOP = object()
+
+# (records, waiter) — waiter: (loop, future) или None
+_Item = Tuple[List[Evidence], Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]]
+
+
+def _resolve(waiter, exc: Optional[BaseException]) -> None:
+    if waiter is None:
+        return
+    loop, fut = waiter
+
+    def _set() -> None:
+        if fut.done():
+            return
+        if exc is None:
+            fut.set_result(None)
+        else:
+            fut.set_exception(exc)
+
+    try:
+        loop.call_soon_threadsafe(_set)
+    except RuntimeError:
+        pass  # loop уже закрыт — ждать некому
+
+
+class EvidenceWriter:
+    def __init__(
+        self,
+        store: EvidenceStore | None = None,
+        mode: str | None = None,
+        flush_ms: int | None = None,
+        max_batch: int = 1000,
+    ):
+        self.mode = (mode or config.EVIDENCE_FLUSH).lower()
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown evidence flush mode: {self.mode!r} (expected one of {MODES})")
+        self._store = store
+        self.flush_s = (config.EVIDENCE_FLUSH_MS if flush_ms is None else flush_ms) / 1000
+        self.max_batch = max_batch
+        self._q: "queue.Queue[object]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # счётчики для логов/метрик
+        self.batches = 0
+        self.records = 0
+
+    @property
+    def store(self) -> EvidenceStore:
+        if self._store is None:
+            self._store = get_store()
+        return self._store
+
+    # --- жизненный цикл ---
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="evidence-writer", daemon=True)
+        self._thread.start()
+
+    async def close(self) -> None:
+        """Дописывает всё из очереди и останавливает поток."""
+        if self._thread is None:
+            return
+        self._closed = True
+        self._q.put(_STOP)
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+        log.info("evidence writer drained: %d records in %d batches", self.records, self.batches)
+
+    # --- API для хендлеров ---
+
+    async def write(self, records: Iterable[Evidence]) -> None:
+        recs = list(records)
+        if not recs:
+            return
+        if self._closed:
+            raise RuntimeError("evidence writer is closed")
+        self.start()
+        if self.mode == "interval":
+            self._q.put((recs, None))
+            return
+        await self._enqueue(recs)
+
+    async def flush(self) -> None:
+        """Ждёт, пока записано всё, что было поставлено в очередь до вызова."""
+        if self._thread is None:
+            return
+        await self._enqueue([])
+
+    async def _enqueue(self, recs: List[Evidence]) -> None:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._q.put((recs, (loop, fut)))
+        await fut
+
+    # --- фоновый поток ---
+
+    def _collect(self, first: _Item) -> Tuple[List[_Item], bool]:
+        """Добирает очередь в одну пачку. Возвращает (items, stop)."""
+        items = [first]
+        n = len(first[0])
+        deadline = time.monotonic() + self.flush_s if self.mode == "interval" else None
+        while n < self.max_batch:
+            try:
+                if deadline is None:
+                    nxt = self._q.get_nowait()
+                else:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    nxt = self._q.get(timeout=left)
+            except queue.Empty:
+                break
+            if nxt is _STOP:
+                return items, True
+            items.append(nxt)  # type: ignore[arg-type]
+            n += len(nxt[0])  # type: ignore[index]
+        return items, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = self._q.get()
+            if first is _STOP:
+                break
+            items, stop = self._collect(first)  # type: ignore[arg-type]
+            batch = [r for recs, _ in items for r in recs]
+            exc: Optional[BaseException] = None
+            if batch:
+                try:
+                    self.store.append(batch, durable=(self.mode == "fsync"))
+                    self.batches += 1
+                    self.records += len(batch)
+                except Exception as e:
+                    log.exception("evidence batch write failed (%d records): %s", len(batch), e)
+                    exc = e
+            for _, waiter in items:
+                _resolve(waiter, exc)
@@ -1,14 +1,72 @@
 from __future__ import annotations
-from typing import List, Tuple
-from .evidence_io import Evidence
+from typing import Dict, Iterable, List, Set, Tuple
+from .evidence_io import Evidence, blob_key
+from .lab_extract import LabRow
+from . import lab_norm
 
 
-def quoted_evidence(evs: List[Evidence]) -> List[str]:
+QUOTE_LIMIT = 300
+LAB_TABLE_LIMIT = 4000  # таблица анализов плотная — режем её гораздо позже
+
+
+def _table_covered(evs: List[Evidence]) -> Dict[str, Set[int]]:
+    """sha256 загрузки → страницы, которые целиком заменены строками lab_table."""
+    covered: Dict[str, Set[int]] = {}
+    for e in evs:
+        src = e.source if isinstance(e.source, dict) else {}
+        if e.role == "lab" and src.get("type") == "lab_table" and src.get("sha256"):
+            covered.setdefault(src["sha256"], set()).update(src.get("pages") or ())
+    return covered
+
+
+def _is_covered(e: Evidence, covered: Dict[str, Set[int]]) -> bool:
+    src = e.source if isinstance(e.source, dict) else {}
+    pages = covered.get(src.get("sha256")) if e.role == "ocr" else None
+    if not pages:
+        return False
+    if "page" in src:
+        return src["page"] in pages
+    # полный текст PDF: лишний, только если все его страницы покрыты таблицами
+    return "parts" in src and len(pages) >= len(src["parts"])
+
+
+def _lab_rows(e: Evidence) -> List[LabRow]:
+    src = e.source if isinstance(e.source, dict) else {}
+    return [LabRow(**r) for r in src.get("labs") or ()] if e.role == "lab" else []
+
+
+def lab_summary(evs: List[Evidence]) -> str:
+    """Анализы всех файлов случая — один батч lab_norm: отклонения первыми, без повторов."""
+    rows = [r for e in evs for r in _lab_rows(e)]
+    return lab_norm.summary(lab_norm.normalize(rows))
+
+
+def quoted_evidence(evs: Iterable[Evidence]) -> List[str]:
+    evs = list(evs)
+    covered = _table_covered(evs)
+    labs = lab_summary(evs)
     quotes: List[str] = []
+    seen = set()
+    emitted = set()
     for e in evs:
+        if _is_covered(e, covered):
+            continue
         frag = e.fragment.strip()
-        if len(frag) > 300:
-            frag = frag[:297] + "…"
+        if _lab_rows(e):
+            # сводка по случаю встаёт на место первой записи с анализами, остальные в ней уже учтены
+            frag, labs = labs, ""
+        # повторная загрузка того же файла/текста не раздувает промпт
+        key = blob_key(frag)
+        if not frag or key in seen:
+            continue
+        seen.add(key)
+        limit = LAB_TABLE_LIMIT if e.role == "lab" else QUOTE_LIMIT
+        if len(frag) > limit:
+            frag = frag[:limit - 3] + "…"
+        # полный текст PDF обрезается до начала первой страницы — та же цитата второй раз не нужна
+        if frag in emitted:
+            continue
+        emitted.add(frag)
         quotes.append(f"{frag}")
     return quotes
 
@@ -7,20 +7,11 @@ import os
 import re
 from typing import Any, Dict, List, Tuple
 
-from openai import OpenAI
-
-from . import config
+from . import config, llm_http
 from .prompts_v3 import INTAKE_SYSTEM_V3
 
 log = logging.getLogger("interviewer")
 
-# --- OpenAI client (org заголовок передаём только если задан) ---
-_client = OpenAI(
-    api_key=config.OPENAI_API_KEY,
-    base_url=config.OPENAI_BASE_URL,
-    organization=None,
-)
-
 
 def _messages_from_history(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
     """
@@ -117,6 +108,56 @@ def _parse_json_strict(text: str) -> Dict[str, Any]:
     raise ValueError("no-json-object-found")
 
 
+# ---------------- Request / response ----------------
+
+def _request(history: List[Dict[str, str]]) -> Dict[str, Any]:
+    return dict(
+        model=config.MODEL_REASONING,
+        input=_messages_from_history(history),
+        temperature=0.1,
+        timeout=llm_http.timeout(config.LLM_TIMEOUT),
+    )
+
+
+def _turn_from_text(text: str) -> Dict[str, Any]:
+    """Ответ модели → шаг интервью; ValueError/JSONDecodeError — если ответ не годится."""
+    log.debug("interviewer raw response: %s", text)
+
+    try:
+        parsed_raw = _parse_json_strict(text)
+    except Exception as e:
+        log.exception("interviewer failed: %s", e)
+        # Мягкий фолбэк: если модель вернула короткую реплику без JSON, используем её как вопрос
+        raw = (text or "").strip()
+        if raw and "\n" not in raw and len(raw) <= 200:
+            return {"done": False, "question": raw, "reason": "nonjson-fallback"}
+        # Иначе — жёсткая ошибка
+        raise
+
+    # нормализуем ключи к нижнему регистру для устойчивости
+    parsed = { (k or "").lower(): v for k, v in parsed_raw.items() }
+
+    ask = (parsed.get("ask") or "").strip()
+    explain = (parsed.get("explain") or "").strip()
+    summary = (parsed.get("summary") or "").strip()
+    red_flags = list(parsed.get("red_flags") or [])
+    urgent = bool(parsed.get("urgent", False))
+    done = bool(parsed.get("done", False)) or (ask == "__DONE__")
+
+    if not done and not ask:
+        raise ValueError("empty-ask-from-model")
+
+    return {
+        "done": done,
+        "question": ("" if ask == "__DONE__" else ask),
+        "explain": explain,
+        "summary": summary,
+        "red_flags": red_flags,
+        "urgent": urgent,
+        "reason": parsed.get("reason") or "model",
+    }
+
+
 # ---------------- Public API ----------------
 
 def next_question(history: List[Dict[str, str]]) -> Dict[str, Any]:
@@ -126,52 +167,20 @@ def next_question(history: List[Dict[str, str]]) -> Dict[str, Any]:
     Если происходит ошибка LLM/парсинга — возвращает:
       {"done": True, "reason": "llm-error: <...>"}
     """
-    msgs = _messages_from_history(history)
-
     try:
-        res = _client.responses.create(
-            model=config.MODEL_REASONING,
-            input=msgs,
-            temperature=0.1,
-        )
-        text = getattr(res, "output_text", None) or ""
-        log.debug("interviewer raw response: %s", text)
-
-        try: 
-            parsed_raw = _parse_json_strict(text)
-        except Exception as e:
-            log.exception("interviewer failed: %s", e)
-            # Мягкий фолбэк: если модель вернула короткую реплику без JSON, используем её как вопрос
-            raw = (locals().get("text") or "").strip()
-            if raw and "\n" not in raw and len(raw) <= 200:
-                return {"done": False, "question": raw, "reason": "nonjson-fallback"}
-            # Иначе — жёсткая ошибка
-            raise
-
-        # нормализуем ключи к нижнему регистру для устойчивости
-        parsed = { (k or "").lower(): v for k, v in parsed_raw.items() }
-
-        ask = (parsed.get("ask") or "").strip()
-        explain = (parsed.get("explain") or "").strip()
-        summary = (parsed.get("summary") or "").strip()
-        red_flags = list(parsed.get("red_flags") or [])
-        urgent = bool(parsed.get("urgent", False))
-        done = bool(parsed.get("done", False)) or (ask == "__DONE__")
-
-        if not done and not ask:
-            raise ValueError("empty-ask-from-model")
-
-        return {
-            "done": done,
-            "question": ("" if ask == "__DONE__" else ask),
-            "explain": explain,
-            "summary": summary,
-            "red_flags": red_flags,
-            "urgent": urgent,
-            "reason": parsed.get("reason") or "model",
-        }
-
+        res = llm_http.sync_client().responses.create(**_request(history))
+        return _turn_from_text(getattr(res, "output_text", None) or "")
     except Exception as e:
         log.exception("interviewer failed: %s", e)
         # Cигнализируем хендлеру остановить интервью и сообщить о проблеме
         return {"done": True, "reason": f"llm-error: {e}"}
+
+
+async def next_question_async(history: List[Dict[str, str]]) -> Dict[str, Any]:
+    """next_question для хендлеров бота — через AsyncOpenAI, тот же формат ответа."""
+    try:
+        res = await llm_http.async_client().responses.create(**_request(history))
+        return _turn_from_text(getattr(res, "output_text", None) or "")
+    except Exception as e:
+        log.exception("interviewer failed: %s", e)
+        return {"done": True, "reason": f"llm-error: {e}"}
@@ -1,20 +1,356 @@
 from __future__ import annotations
+import json
 import re
-from typing import Dict, List, Tuple
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import pdfplumber
 from .utils import normalize_text
 
-# Very primitive patterns — extend per your lab formats
-PATTERNS = {
-    "cbc": re.compile(r"\b(Hb|Hemoglobin|Гемоглобин)\s*[:=]?\s*(\d+[\.,]?\d*)\b", re.I),
-    "crp": re.compile(r"\b(CRP|СРБ)\s*[:=]?\s*(\d+[\.,]?\d*)\b", re.I),
-    "creatinine": re.compile(r"\b(Creatinine|Креатинин)\s*[:=]?\s*(\d+[\.,]?\d*)\b", re.I),
-}
+# ---------------- Analyte catalog ----------------
+# Каталог анализов — данные, а не код: lab_catalog.json, по записи на анализ
+# (каноническое имя, панель, каноническая единица, RU/EN синонимы, единицы,
+# референс взрослого в канонической единице — null там, где он зависит от пола/цикла).
+# Все синонимы компилируются в одно регулярное выражение-trie, так что текст
+# сканируется один раз, сколько бы анализов ни было в каталоге.
+CATALOG_PATH = Path(__file__).with_name("lab_catalog.json")
+
+
+@dataclass(frozen=True)
+class Analyte:
+    name: str
+    panel: str
+    unit: str
+    synonyms: Tuple[str, ...]
+    units: Dict[str, float] = field(default_factory=dict, hash=False)  # написание → множитель к unit
+    ref: Tuple[Optional[float], Optional[float]] = (None, None)
+
+
+@dataclass
+class LabHit:
+    analyte: str
+    value: str
+    unit: str = ""
+    start: int = 0
+
+
+_POWER_UNIT_RE = re.compile(r"^x?10[\^*](\d+)(/.+)$")
+_SUPERSCRIPT = str.maketrans("0123456789", "⁰¹²³⁴⁵⁶⁷⁸⁹")
+
+
+def unit_spellings(unit: str) -> List[str]:
+    """Написания степенной единицы в бланках: '10^9/л' → 'x10^9/л', '×10^9/л', '10⁹/л', '*10^9/л'…"""
+    m = _POWER_UNIT_RE.match(unit)
+    if not m:
+        return [unit]
+    power, rest = m.groups()
+    powers = (f"10^{power}", f"10*{power}", "10" + power.translate(_SUPERSCRIPT))
+    # x — латинская, х — кириллическая: в бланках встречаются обе
+    return [pre + p + rest for pre in ("", "x", "×", "х", "*", "x ", "× ", "х ") for p in powers]
+
+
+def _units(raw: Dict[str, float]) -> Dict[str, float]:
+    units: Dict[str, float] = {}
+    for u, f in raw.items():
+        for v in unit_spellings(u):
+            units.setdefault(v, f)
+    return units
+
+
+def load_catalog(path: Path | None = None) -> List[Analyte]:
+    raw = json.loads(Path(path or CATALOG_PATH).read_text(encoding="utf-8"))
+    return [
+        Analyte(
+            a["name"], a.get("panel", ""), a.get("unit", ""), tuple(a["synonyms"]),
+            _units(a.get("units", {})), tuple(a.get("ref") or (None, None)),
+        )
+        for a in raw
+    ]
+
+
+def _key(s: str) -> str:
+    return " ".join(s.split()).lower()
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """Альтернация слов, свёрнутая по общим префиксам: 'hb|hba1c|hct' → 'h(?:b(?:a1c)?|ct)'.
+
+    Движку regex не нужно перебирать все синонимы в каждой позиции — только
+    ветки trie; более длинное совпадение пробуется первым.
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        end = "" in node
+        alts = [(r"\s+" if ch == " " else re.escape(ch)) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 and not end else "(?:" + "|".join(alts) + ")"
+        if end:
+            body = body if body.startswith("(?:") else "(?:" + body + ")"
+            body += "?"
+        return body
+
+    return build(trie)
+
+
+_VALUE = r"(?P<value>[<>≤≥]?\d+(?:[.,]\d+)?)"
+# токен сразу за числом, похожий на единицу, которой нет в каталоге: «2000 МЕ», «5 мг/сут»
+_NEXT_TOKEN = re.compile(r"[ \t]*([^\s,;:()]+)")
+_NOT_UNITS = frozenset("и в во на по от до при не или а с со к у о and or in at on of to for".split())
+SHORT_SYNONYM = 2  # «K», «Ca», «ПВ» в свободном тексте — только с единицей этого анализа
+
+
+class LabMatcher:
+    """Все синонимы каталога → одно выражение; scan() проходит текст один раз."""
+
+    def __init__(self, catalog: List[Analyte]):
+        self.catalog = catalog
+        self.by_name: Dict[str, Analyte] = {a.name: a for a in catalog}
+        self.by_synonym: Dict[str, Analyte] = {}
+        for a in catalog:
+            for s in a.synonyms:
+                self.by_synonym.setdefault(_key(s), a)
+        # единица — только из написаний каталога, иначе она съест имя следующего анализа
+        units = {_key(u) for a in catalog for u in a.units if u}
+        # синоним [+ «(HGB)»] [:|=] число [единица]
+        self.rx = re.compile(
+            rf"(?<!\w)(?P<syn>{trie_regex(self.by_synonym)})(?!\w)"
+            rf"\s*(?:\([^()\n]{{0,40}}\)\s*)?[:=]?\s*{_VALUE}(?!\d|[.,]\d)"
+            rf"(?:\s*(?P<unit>{trie_regex(units)})(?![\w/]))?",
+            re.I,
+        )
+        self.name_rx = re.compile(rf"(?<!\w)({trie_regex(self.by_synonym)})(?!\w)", re.I)
+        self._units: Dict[str, frozenset] = {}
+
+    def _units_of(self, a: Analyte) -> frozenset:
+        units = self._units.get(a.name)
+        if units is None:
+            units = self._units[a.name] = frozenset(_key(u) for u in a.units)
+        return units
+
+    def analyte_of(self, name: str) -> Optional[Analyte]:
+        """Анализ каталога по имени из бланка: 'Гемоглобин (HGB)' → hemoglobin."""
+        if name in self.by_name:
+            return self.by_name[name]
+        m = self.name_rx.search(name)
+        return self.by_synonym.get(_key(m.group(1))) if m else None
+
+    def scan(self, text: str) -> List[LabHit]:
+        hits: List[LabHit] = []
+        for m in self.rx.finditer(text):
+            a = self.by_synonym.get(_key(m.group("syn")))
+            if a is None:
+                continue
+            unit = m.group("unit") or ""
+            if not unit and _unit_like(text, m.end()):
+                continue  # доза, мл, «палата 12 к» — не результат анализа
+            if len(m.group("syn")) <= SHORT_SYNONYM and _key(unit) not in self._units_of(a):
+                continue  # номер кабинета, «K 12» — короткое имя без своей единицы
+            hits.append(LabHit(a.name, m.group("value").replace(",", "."), unit, m.start()))
+        return hits
+
+
+def _unit_like(text: str, pos: int) -> bool:
+    """За числом на той же строке — единица не из каталога (с «/» или короткое слово)."""
+    m = _NEXT_TOKEN.match(text, pos)
+    if not m:
+        return False
+    tok = m.group(1).rstrip(".")
+    if "/" in tok or "^" in tok:
+        return True
+    return tok.isalpha() and len(tok) <= 4 and tok.lower() not in _NOT_UNITS
+
+
+@lru_cache(maxsize=1)
+def matcher() -> LabMatcher:
+    return LabMatcher(load_catalog())
 
 
 def extract_panels(text: str) -> List[Tuple[str, str]]:
-    text = normalize_text(text)
-    hits: List[Tuple[str, str]] = []
-    for name, rx in PATTERNS.items():
-        for m in rx.finditer(text):
-            hits.append((name, m.group(2).replace(",", ".")))
-    return hits
\ No newline at end of file
+    """(каноническое имя, значение) для всех анализов каталога в тексте.
+
+    Текст ожидается уже нормализованным (страницы из ocr — такие);
+    пробелы внутри многословных синонимов матчер всё равно допускает.
+    """
+    return [(h.analyte, h.value) for h in matcher().scan(text)]
+
+
+def extract_rows(text: str, page: int = 0) -> List[LabRow]:
+    """То же, но строками LabRow с единицами — для lab_norm."""
+    return [LabRow(h.analyte, h.value, h.unit, page=page) for h in matcher().scan(text)]
+
+
+# ---------------- Tables from the PDF layer ----------------
+# Бланки лабораторий — таблицы «показатель | результат | ед. | референс | флаг».
+# Берём их из pdfplumber напрямую: единицы, референсы и флаги сохраняются,
+# а в LLM уходит плотная таблица вместо страниц текста.
+
+# заголовок колонки → поле LabRow (по подстроке, в нижнем регистре)
+HEADER_WORDS: Dict[str, Tuple[str, ...]] = {
+    "analyte": ("показател", "исследован", "наименован", "тест", "analyte", "test", "parameter", "name"),
+    "value": ("результат", "значени", "result", "value"),
+    "unit": ("ед.", "ед ", "единиц", "unit"),
+    "range": ("референс", "норм", "reference", "range", "ref"),
+    "flag": ("флаг", "отметк", "flag"),
+    "date": ("дата", "date"),
+}
+
+NUMBER_RE = re.compile(r"[<>≤≥]?\s*\d+(?:[.,]\d+)?")
+VALUE_RE = re.compile(r"^([<>≤≥]?\s*\d+(?:[.,]\d+)?)\s*(.*)$")
+DATE_RE = re.compile(r"\b(\d{2})[./](\d{2})[./](\d{4})\b|\b(\d{4})-(\d{2})-(\d{2})\b")
+FLAG_MARKS = {"↑": "H", "↓": "L", "H": "H", "L": "L", "*": "*", "+": "H", "-": "L"}
+TABLE_TEXT_SHARE = 0.95  # в таблицах почти весь текст страницы — её текст не нужен
+
+_TEXT_TABLES = {"vertical_strategy": "text", "horizontal_strategy": "text"}
+
+
+@dataclass
+class LabRow:
+    analyte: str
+    value: str
+    unit: str = ""
+    range: str = ""
+    flag: str = ""
+    date: str = ""
+    page: int = 0
+
+    def compact(self) -> str:
+        s = f"{self.analyte}: {self.value}"
+        if self.unit:
+            s += f" {self.unit}"
+        if self.range:
+            s += f" (ref {self.range})"
+        if self.flag:
+            s += f" {self.flag}"
+        if self.date:
+            s += f" [{self.date}]"
+        return s
+
+
+def _cell(c: Optional[str]) -> str:
+    return normalize_text(c or "")
+
+
+def _iso_date(s: str) -> str:
+    m = DATE_RE.search(s)
+    if not m:
+        return ""
+    if m.group(1):
+        return f"{m.group(3)}-{m.group(2)}-{m.group(1)}"
+    return f"{m.group(4)}-{m.group(5)}-{m.group(6)}"
+
+
+def _header_map(row: List[str]) -> Dict[str, int]:
+    cols: Dict[str, int] = {}
+    for i, cell in enumerate(row):
+        low = cell.lower() + " "
+        for field, words in HEADER_WORDS.items():
+            if field not in cols and any(w in low for w in words):
+                cols[field] = i
+                break
+    return cols if {"analyte", "value"} <= cols.keys() else {}
+
+
+def _split_flag(value: str) -> Tuple[str, str]:
+    """'118 ↓' / '5.4*' → ('118', 'L') / ('5.4', '*')."""
+    value = value.strip()
+    for mark, flag in FLAG_MARKS.items():
+        rest = value[: -len(mark)].strip()
+        # только «число + отметка»: у '5 mmol/L' буква L — часть единицы
+        if value.endswith(mark) and NUMBER_RE.fullmatch(rest):
+            return rest, flag
+    return value, ""
+
+
+def _parse_table(table: List[List[Optional[str]]], page: int, page_date: str) -> Tuple[List[LabRow], int]:
+    """(строки, сколько строк с данными не разобрали)."""
+    rows = [[_cell(c) for c in r] for r in table if r and any(c for c in r)]
+    out: List[LabRow] = []
+    lost = 0
+    cols: Dict[str, int] = {}
+    for r in rows:
+        hdr = _header_map(r)
+        if hdr:
+            cols = hdr  # в одной таблице бывает несколько секций со своими заголовками
+            continue
+        if not cols:
+            lost += 1
+            continue
+        get = lambda f: r[cols[f]] if f in cols and cols[f] < len(r) else ""
+        analyte = get("analyte")
+        value, flag = _split_flag(get("value"))
+        if not value:
+            # подзаголовок секции — только название без цифр; остальное (комментарии) теряется
+            if not (analyte and sum(1 for c in r if c) == 1 and not re.search(r"\d", analyte)):
+                lost += 1
+            continue
+        if not analyte:
+            lost += 1
+            continue
+        m = VALUE_RE.match(value)
+        if m:
+            value, rest = m.group(1).replace(" ", "").replace(",", "."), m.group(2)
+        else:
+            rest = ""  # качественный результат: «положительно», «не обнаружено»
+        unit = get("unit") or rest
+        flag = get("flag") or flag
+        # референс — как в бланке: «120-160», «< 5», «отрицательно»
+        out.append(LabRow(analyte, value, unit, get("range"), flag, _iso_date(get("date")) or page_date, page))
+    return out, lost
+
+
+def parse_table(table: List[List[Optional[str]]], page: int = 0, page_date: str = "") -> List[LabRow]:
+    """Строки таблицы с заголовком (analyte + value обязательны) → LabRow."""
+    return _parse_table(table, page, page_date)[0]
+
+
+def _inside(c: dict, boxes: List[Tuple[float, float, float, float]]) -> bool:
+    x, y = (c["x0"] + c["x1"]) / 2, (c["top"] + c["bottom"]) / 2
+    return any(x0 <= x <= x1 and top <= y <= bottom for x0, top, x1, bottom in boxes)
+
+
+def extract_tables(path: Path, max_pages: int = 0) -> Tuple[List[LabRow], List[int]]:
+    """(строки анализов, номера страниц, целиком переданных строками таблиц).
+
+    Сначала таблицы по линиям разметки; если их нет — по выравниванию текста
+    (без заголовка с «показатель/результат» такие строки не принимаются).
+    Страница считается покрытой, только если все строки её таблиц разобраны
+    и в таблицах не меньше TABLE_TEXT_SHARE символов страницы — иначе
+    комментарии и шапка бланка остаются в цитате страницы.
+    """
+    rows: List[LabRow] = []
+    table_pages: List[int] = []
+    with pdfplumber.open(path) as pdf:
+        n = len(pdf.pages) if max_pages <= 0 else min(max_pages, len(pdf.pages))
+        for i in range(n):
+            page = pdf.pages[i]
+            try:
+                page_date = _iso_date(page.extract_text() or "")
+                found = page.find_tables() or page.find_tables(_TEXT_TABLES)
+                boxes = []
+                complete = bool(found)
+                for t in found:
+                    got, lost = _parse_table(t.extract(), i + 1, page_date)
+                    rows.extend(got)
+                    if got:
+                        boxes.append(t.bbox)
+                    complete = complete and bool(got) and not lost
+                if complete:
+                    chars = [c for c in page.chars if c["text"].strip()]
+                    inside = sum(1 for c in chars if _inside(c, boxes))
+                    if chars and inside >= TABLE_TEXT_SHARE * len(chars):
+                        table_pages.append(i + 1)
+            finally:
+                page.close()
+    return rows, table_pages
+
+
+def rows_to_text(rows: List[LabRow]) -> str:
+    return "\n".join(r.compact() for r in rows)
@@ -0,0 +1,168 @@
+# bot/lab_norm.py
+"""Анализы случая: канонические единицы, референсы, флаги.
+
+Все строки случая — таблицы из PDF и находки матчера во всех файлах —
+обрабатываются одним батчем на массивах numpy: значение × множитель единицы
+из каталога, сравнение с референсом бланка (его нет — с референсом каталога),
+флаг H/L и severity — на сколько ширин референса значение вышло за него.
+summary() — компактный текст для промпта: сначала отклонения (сильнейшие
+первыми), потом всё остальное в исходном порядке.
+"""
+from __future__ import annotations
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .lab_extract import Analyte, LabRow, matcher
+
+NUM_RE = re.compile(r"\d+(?:\.\d+)?")
+VALUE_RE = re.compile(r"^\s*([<>≤≥]?)\s*(\d+(?:\.\d+)?)")
+UPPER_ONLY_RE = re.compile(r"[<≤]|\bдо\b|\bменее\b|\bless\b|\bup to\b", re.I)
+LOWER_ONLY_RE = re.compile(r"[>≥]|\bот\b|\bболее\b|\bбольше\b|\bmore\b|\bover\b", re.I)
+
+_unit_maps: Dict[str, Dict[str, float]] = {}
+
+
+@dataclass
+class LabResult:
+    analyte: str
+    value: float
+    unit: str
+    low: float          # nan — границы нет
+    high: float
+    flag: str = ""      # "H" / "L" или отметка бланка
+    severity: float = 0.0
+    date: str = ""
+    page: int = 0
+    cmp: str = ""       # "<" / ">" из «<0.5»
+    raw: str = ""       # исходные «значение единица», если пересчитали
+    text: str = ""      # качественный результат («положительно»); value тогда nan
+    ref: str = ""       # референс бланка как есть, если он не числовой
+
+    def compact(self) -> str:
+        s = f"{self.analyte}: {self.text or f'{self.cmp}{self.value:.4g}'}"
+        if self.unit:
+            s += f" {self.unit}"
+        lo, hi = not math.isnan(self.low), not math.isnan(self.high)
+        if self.ref:
+            s += f" (ref {self.ref})"
+        elif lo and hi:
+            s += f" (ref {self.low:.4g}-{self.high:.4g})"
+        elif hi:
+            s += f" (ref <{self.high:.4g})"
+        elif lo:
+            s += f" (ref >{self.low:.4g})"
+        if self.flag:
+            s += f" {self.flag}"
+        if self.raw:
+            s += f" [= {self.raw}]"
+        if self.date:
+            s += f" [{self.date}]"
+        return s
+
+
+def parse_range(s: str) -> Tuple[float, float]:
+    """'120-160' → (120, 160); '< 5' / 'до 5' → (nan, 5); '> 1' → (1, nan); 'отрицательно' → (nan, nan)."""
+    s = (s or "").replace(",", ".")
+    nums = NUM_RE.findall(s)
+    if len(nums) >= 2:
+        return float(nums[0]), float(nums[1])
+    if len(nums) == 1:
+        if UPPER_ONLY_RE.search(s):
+            return math.nan, float(nums[0])
+        if LOWER_ONLY_RE.search(s):
+            return float(nums[0]), math.nan
+    return math.nan, math.nan
+
+
+def _value(s: str) -> Tuple[str, float]:
+    m = VALUE_RE.match((s or "").replace(",", "."))
+    return (m.group(1), float(m.group(2))) if m else ("", math.nan)
+
+
+def _factor(a: Optional[Analyte], unit: str) -> float:
+    """Множитель к канонической единице; nan — единицы нет или анализ/единица каталогу неизвестны."""
+    if a is None:
+        return math.nan
+    unit = " ".join(unit.split()).lower()
+    # без единицы пересчитывать не во что: число из текста (доза, номер палаты)
+    # сравнивается только с референсом бланка; "" в каталоге — у безразмерных (МНО, pH)
+    units = _unit_maps.get(a.name)
+    if units is None:
+        units = _unit_maps[a.name] = {" ".join(u.split()).lower(): f for u, f in a.units.items()}
+    return float(units.get(unit, math.nan))
+
+
+def normalize(rows: Sequence[LabRow]) -> List[LabResult]:
+    """Все строки случая одним батчем; повторы (анализ, значение, дата) схлопываются.
+
+    Качественные результаты («положительно», «не обнаружено») идут как есть:
+    без пересчёта и своих флагов, только с отметкой бланка.
+    """
+    n = len(rows)
+    if not n:
+        return []
+    m = matcher()
+    analytes = [m.analyte_of(r.analyte) for r in rows]
+    parsed = [_value(r.value) for r in rows]
+
+    vals = np.array([v for _, v in parsed], dtype=float)
+    factor = np.array([_factor(a, r.unit) for a, r in zip(analytes, rows)], dtype=float)
+    own = np.array([parse_range(r.range) for r in rows], dtype=float).reshape(n, 2)
+    cat = np.array([a.ref if a else (None, None) for a in analytes], dtype=float).reshape(n, 2)
+
+    conv = ~np.isnan(factor)
+    f = np.where(conv, factor, 1.0)  # неизвестную единицу не трогаем — сравниваем с референсом бланка как есть
+    v = vals * f
+    # референс бланка важнее каталожного: он учитывает пол, возраст и метод
+    has_own = ~np.isnan(own).all(axis=1)
+    low = np.where(has_own, own[:, 0] * f, np.where(conv, cat[:, 0], np.nan))
+    high = np.where(has_own, own[:, 1] * f, np.where(conv, cat[:, 1], np.nan))
+
+    with np.errstate(invalid="ignore"):
+        below = v < low
+        above = v > high
+        width = high - low
+        width = np.where(np.isfinite(width) & (width > 0), width, np.where(np.isfinite(high), np.abs(high), np.abs(low)))
+        width = np.where(np.isfinite(width) & (width > 0), width, 1.0)
+        severity = np.where(below, (low - v) / width, np.where(above, (v - high) / width, 0.0))
+    flags = np.where(below, "L", np.where(above, "H", ""))
+    abnormal = below | above | np.array([bool(r.flag) for r in rows])
+
+    # отклонения — первыми, по убыванию severity; остальное — в исходном порядке
+    order = np.lexsort((np.arange(n), -severity, ~abnormal))
+
+    names = [a.name if a else r.analyte for a, r in zip(analytes, rows)]
+    # находка без даты, совпавшая со строкой таблицы с датой, — та же строка
+    dated = {(names[i], round(float(v[i]), 3)) for i in range(n) if rows[i].date}
+    out: List[LabResult] = []
+    seen = set()
+    for i in order.tolist():
+        r, a, name = rows[i], analytes[i], names[i]
+        if math.isnan(v[i]):
+            text = " ".join(r.value.split())
+            key = (name, text.lower(), r.date)
+            if not text or key in seen:
+                continue
+            seen.add(key)
+            out.append(LabResult(name, math.nan, r.unit, math.nan, math.nan, r.flag, 0.0, r.date, r.page,
+                                 text=text, ref=r.range))
+            continue
+        key = (name, round(float(v[i]), 3), r.date)
+        if key in seen or (not r.date and key[:2] in dated):
+            continue  # тот же файл дважды, страница и её таблица
+        seen.add(key)
+        unit = a.unit if conv[i] and a else r.unit
+        raw = f"{r.value} {r.unit}".strip() if conv[i] and factor[i] != 1.0 else ""
+        out.append(LabResult(
+            name, float(v[i]), unit, float(low[i]), float(high[i]), str(flags[i]) or r.flag,
+            float(severity[i]), r.date, r.page, parsed[i][0], raw,
+        ))
+    return out
+
+
+def summary(results: Sequence[LabResult]) -> str:
+    return "\n".join(r.compact() for r in results)
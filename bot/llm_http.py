@@ -0,0 +1,137 @@
+# bot/llm_http.py
+"""Общий HTTP-слой для всех обращений к модели (reviewer, interviewer).
+
+Раньше у reviewer был свой httpx.Client без keep-alive (Connection: close —
+TCP+TLS заново на каждый разбор), а у interviewer — отдельный OpenAI со своими
+дефолтами. Теперь один пул на процесс: keep-alive (LLM_MAX_KEEPALIVE), опционально
+HTTP/2 (нужен пакет h2), таймауты и прокси из config. Клиенты создаются лениво,
+при первом запросе: отдельно синхронный (скрипты, регресс) и асинхронный (бот).
+
+STATS считает запросы и новые соединения/TLS-рукопожатия (trace-события
+httpcore): reused = requests - connections.
+"""
+from __future__ import annotations
+import logging
+import threading
+from collections import Counter
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from bot import config
+
+try:  # нужен httpx для http2=True
+    import h2
+except ImportError:
+    h2 = None
+
+log = logging.getLogger("llm_http")
+
+STATS: Counter = Counter()
+_lock = threading.Lock()
+_sync: Optional[OpenAI] = None
+_async: Optional[AsyncOpenAI] = None
+
+
+def _on_trace(name: str) -> None:
+    if name == "connection.connect_tcp.complete":
+        STATS["connections"] += 1
+    elif name == "connection.start_tls.complete":
+        STATS["tls_handshakes"] += 1
+
+
+def _trace(name: str, info: dict) -> None:
+    _on_trace(name)
+
+
+async def _atrace(name: str, info: dict) -> None:
+    _on_trace(name)
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        STATS["requests"] += 1
+        request.extensions["trace"] = _trace
+        return super().handle_request(request)
+
+
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        STATS["requests"] += 1
+        request.extensions["trace"] = _atrace
+        return await super().handle_async_request(request)
+
+
+def _http2() -> bool:
+    if config.LLM_HTTP2 and h2 is None:
+        log.warning("LLM_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+        return False
+    return config.LLM_HTTP2
+
+
+def timeout(read_s: float | None = None) -> httpx.Timeout:
+    """Таймаут вызова: чтение — своё у каждого вызова, подключение — общее."""
+    return httpx.Timeout(read_s or config.LLM_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT)
+
+
+def _transport_kwargs() -> dict:
+    return dict(
+        http2=_http2(),
+        proxy=config.LLM_PROXY or None,
+        limits=httpx.Limits(
+            max_connections=config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=config.LLM_MAX_KEEPALIVE,
+            keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY,
+        ),
+        retries=1,  # только повтор подключения; повторы запросов — у SDK
+    )
+
+
+def _client_kwargs() -> dict:
+    return dict(
+        api_key=(config.OPENAI_API_KEY or "").strip(),
+        base_url=(config.OPENAI_BASE_URL or "https://api.openai.com/v1").strip(),
+        organization=None,  # org-заголовок не передаём
+    )
+
+
+def sync_client() -> OpenAI:
+    global _sync
+    with _lock:
+        if _sync is None:
+            http = httpx.Client(transport=_CountingTransport(**_transport_kwargs()), timeout=timeout())
+            _sync = OpenAI(http_client=http, **_client_kwargs())
+        return _sync
+
+
+def async_client() -> AsyncOpenAI:
+    global _async
+    with _lock:
+        if _async is None:
+            http = httpx.AsyncClient(transport=_AsyncCountingTransport(**_transport_kwargs()), timeout=timeout())
+            _async = AsyncOpenAI(http_client=http, **_client_kwargs())
+        return _async
+
+
+def stats() -> dict:
+    requests, connections = STATS["requests"], STATS["connections"]
+    return {
+        "requests": requests,
+        "connections": connections,
+        "tls_handshakes": STATS["tls_handshakes"],
+        "reused": max(0, requests - connections),
+        "reuse_rate": round(1 - connections / requests, 3) if requests else 0.0,
+    }
+
+
+async def aclose() -> None:
+    global _sync, _async
+    with _lock:
+        clients, _sync, _async = (_sync, _async), None, None
+    sync, async_ = clients
+    if async_ is not None:
+        await async_.close()
+    if sync is not None:
+        sync.close()
+    log.info("llm http: %s", stats())
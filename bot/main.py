@@ -1,11 +1,17 @@
 # bot/main.py
 from __future__ import annotations
 import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
 from pathlib import Path
-from typing import Dict, List
+from typing import Deque, Dict, List
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters import Command, CommandStart
 from aiogram.types import Message, ContentType
 from aiogram.fsm.state import StatesGroup, State
@@ -17,12 +23,18 @@ import json
 
 from bot import config
 from .utils import new_case_id, now_iso, normalize_text, sha256_of
-from .ocr import ocr_image, parse_pdf
-from .lab_extract import extract_panels
-from .evidence_io import Evidence, append_evidence, load_evidence
+from . import llm_http, ocr
+from .ocr_pool import OcrPool, OcrQueueFull
+from .lab_extract import LabRow, extract_rows
+from . import lab_norm
+from .evidence_io import Evidence, CachedEvidenceStore, SegmentedEvidenceStore, blob_key, get_store, iter_evidence
+from .evidence_writer import EvidenceWriter
+from .evidence_compact import compactor_loop
 from .handoff import quoted_evidence, package_outputs
-from .reviewer import analyze_case, friendly_message
-from .interviewer import next_question  # новый динамический интервьюер
+from .reviewer import analyze_case_async, friendly_message_stream
+from .interviewer import next_question_async  # новый динамический интервьюер
+
+log = logging.getLogger("bot")
 
 # ---------- BOT ----------
 bot = Bot(
@@ -31,6 +43,38 @@ bot = Bot(
 )
 dp = Dispatcher(storage=MemoryStorage())
 
+# запись evidence — фоновым group-commit'ом, а не в event loop
+evidence_writer = EvidenceWriter()
+# OCR — в пуле процессов, хендлеры только ждут результат
+ocr_pool = OcrPool()
+_background: List[asyncio.Task] = []
+PROGRESS_EDIT_S = 1.0
+TELEGRAM_TEXT_LIMIT = 4096
+# время от /review до первого видимого текста ответа, с
+REVIEW_TTFT: Deque[float] = deque(maxlen=1000)
+
+@dp.startup()
+async def on_startup():
+    evidence_writer.start()
+    store = get_store(raw=True)
+    if isinstance(store, SegmentedEvidenceStore) and config.COMPACT_INTERVAL_S > 0:
+        _background.append(asyncio.create_task(compactor_loop(store)))
+
+@dp.shutdown()
+async def on_shutdown():
+    for t in _background:
+        t.cancel()
+    await ocr_pool.close()
+    await evidence_writer.close()
+    await llm_http.aclose()
+    store = get_store()
+    if isinstance(store, CachedEvidenceStore):
+        log.info("evidence cache: %s", store.stats())
+    if REVIEW_TTFT:
+        ttft = sorted(REVIEW_TTFT)
+        log.info("review time to first text: n=%d p50=%.2fs p95=%.2fs", len(ttft),
+                 ttft[len(ttft) // 2], ttft[min(len(ttft) - 1, int(len(ttft) * 0.95))])
+
 # ---------- FSM ----------
 class Intake(StatesGroup):
     dynamic = State()
@@ -83,7 +127,7 @@ async def on_dynamic_step(m: Message, state: FSMContext):
         source={"type": "intake_dynamic", "message_id": m.message_id},
         created_at=now_iso(),
     )
-    append_evidence([ev])
+    await evidence_writer.write([ev])
 
     # 2) поддерживаем историю для LLM
     data = await state.get_data()
@@ -92,7 +136,7 @@ async def on_dynamic_step(m: Message, state: FSMContext):
     turns = int(data.get("turns", 0)) + 1
 
     # 3) спрашиваем следующий шаг у модели
-    resp = next_question(history)
+    resp = await next_question_async(history)
 
     # 3a) если это LLM-ошибка — прекращаем сценарий
     if str(resp.get("reason", "")).startswith("llm-error"):
@@ -158,7 +202,7 @@ async def on_add_text_payload(m: Message, state: FSMContext):
         source={"type": "add_text", "message_id": m.message_id},
         created_at=now_iso(),
     )
-    append_evidence([ev])
+    await evidence_writer.write([ev])
     await state.clear()
     await m.answer(f"📝 Текст добавлен к делу <code>{case_id}</code>.")
 
@@ -169,6 +213,47 @@ async def on_add_file(m: Message, state: FSMContext):
     await state.set_state(Intake.awaiting_file)
     await m.answer(f"📎 Пришлите файл (PDF/JPG/PNG). Дело: <code>{cid}</code>")
 
+async def _show_progress(m: Message, progress: Message | None, last_edit: float, text: str, final: bool):
+    """Одно сообщение о прогрессе, правим не чаще PROGRESS_EDIT_S (лимиты Telegram).
+
+    Возвращает (сообщение, время последней правки, показан ли этот текст).
+    Финальный текст не теряется: не удалось поправить — отправляем новым сообщением.
+    """
+    now = time.monotonic()
+    if progress is None:
+        return await m.answer(text), now, True
+    if final or now - last_edit >= PROGRESS_EDIT_S:
+        try:
+            await progress.edit_text(text)
+        except TelegramRetryAfter as e:
+            if not final:
+                # промежуточную правку пропускаем и молчим, пока Telegram просит подождать
+                return progress, now + e.retry_after - PROGRESS_EDIT_S, False
+            await asyncio.sleep(e.retry_after)
+            try:
+                await progress.edit_text(text)
+            except (TelegramBadRequest, TelegramRetryAfter):
+                return await m.answer(text), now, True
+        except TelegramBadRequest as e:  # "message is not modified" и т.п. — не повод падать
+            if final and "not modified" not in str(e):
+                return await m.answer(text), now, True
+        return progress, now, True
+    return progress, last_edit, False
+
+def _clip_html(text: str, room: int) -> str:
+    """escape(text) не длиннее room: режем исходный текст, а не готовый HTML (не рвём &amp;)."""
+    out = escape(text)
+    if len(out) <= room:
+        return out
+    lo, hi = 0, min(len(text), room - 1)  # самый длинный префикс, который влезает после escape
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if len(escape(text[:mid])) <= room - 1:
+            lo = mid
+        else:
+            hi = mid - 1
+    return escape(text[:lo]) + "…"
+
 @dp.message(Intake.awaiting_file, F.content_type.in_({ContentType.DOCUMENT, ContentType.PHOTO}))
 async def on_file_payload(m: Message, state: FSMContext):
     user_id = m.from_user.id
@@ -188,36 +273,82 @@ async def on_file_payload(m: Message, state: FSMContext):
     raw = dest.read_bytes()
     meta = {"type": "upload", "path": str(dest), "sha256": sha256_of(raw)}
 
-    fragments = []
-    if dest.suffix.lower() == ".pdf":
-        full, per_page = parse_pdf(dest)
-        fragments.append(("ocr", full, {**meta}))
-        for page_idx, page_text in per_page:
-            fragments.append(("ocr", page_text, {**meta, "page": page_idx}))
-    else:
-        text = ocr_image(dest)
-        fragments.append(("ocr", text, meta))
-
-    # Примитивная выжимка лабораторных панелей (regex)
-    lab_hits = []
-    for _, frag, _ in fragments:
-        lab_hits.extend(extract_panels(frag))
-    if lab_hits:
-        lab_text = "; ".join([f"{k}={v}" for k, v in lab_hits])
-        fragments.append(("lab", lab_text, {"type": "lab_extract"}))
-
-    evs = [
-        Evidence(
+    def ocr_evidence(role: str, frag: str, source: dict) -> Evidence:
+        return Evidence(
             case_id=case_id,
             user_id=user_id,
             role=role,
             fragment=frag,
-            source=meta2,
+            source=source,
             created_at=now_iso(),
         )
-        for role, frag, meta2 in fragments
-    ]
-    append_evidence(evs)
+
+    # Выжимка анализов по каталогу (lab_catalog.json) — по мере поступления текста;
+    # для страниц PDF, целиком покрытых таблицами анализов, вместо неё — строки таблиц (lab_table)
+    lab_hits: List[LabRow] = []
+    lab_rows: List[LabRow] = []
+    table_pages: List[int] = []
+    try:
+        if dest.suffix.lower() == ".pdf":
+            progress = None
+            last_edit = 0.0
+            total = 0
+            page_keys: List[str] = []  # sha страниц, сами тексты не держим
+            async for page_idx, total, page_text in ocr_pool.iter_pdf(dest, sha256=meta["sha256"]):
+                # каждую страницу сохраняем сразу, не дожидаясь конца документа
+                await evidence_writer.write([ocr_evidence("ocr", page_text, {**meta, "page": page_idx})])
+                page_keys.append(blob_key(page_text))
+                lab_hits.extend(extract_rows(page_text, page_idx))
+                progress, last_edit, _ = await _show_progress(
+                    m, progress, last_edit, f"📄 Страница {page_idx}/{total}",
+                    final=page_idx == ocr.page_budget(total),
+                )
+            if config.EVIDENCE_BLOBS:
+                # полный текст — только ссылки на блобы страниц, склеивается при чтении;
+                # без блобов его нет: весь текст и так лежит постранично
+                await evidence_writer.write([ocr_evidence("ocr", "", {**meta, "parts": page_keys})])
+            if len(page_keys) < total:
+                await m.answer(
+                    f"⚠️ В файле {total} стр., прочитаны первые {len(page_keys)}. "
+                    "Если важное дальше — пришлите эти страницы отдельным файлом."
+                )
+        else:
+            source = "photo" if m.photo else "image"
+            text = await ocr_pool.ocr_image(dest, sha256=meta["sha256"], source=source)
+            await evidence_writer.write([ocr_evidence("ocr", text, meta)])
+            lab_hits.extend(extract_rows(text))
+    except OcrQueueFull:
+        # состояние awaiting_file не сбрасываем — можно просто прислать файл снова
+        await m.answer("⏳ Сейчас обрабатывается много файлов. Пришлите этот файл ещё раз через минуту.")
+        return
+    except BrokenProcessPool:
+        # воркер OCR упал (чаще всего — память на огромном скане); пул уже пересоздаётся
+        log.exception("ocr worker died on %s", dest.name)
+        await m.answer("❌ Не удалось распознать файл. Попробуйте прислать его ещё раз или в меньшем размере.")
+        return
+
+    if dest.suffix.lower() == ".pdf":
+        try:
+            lab_rows, table_pages = await ocr_pool.lab_tables(dest)
+        except OcrQueueFull:
+            log.warning("lab tables skipped for %s: OCR queue is full", dest.name)
+        except BrokenProcessPool:
+            log.exception("lab tables skipped for %s: OCR worker died", dest.name)
+
+    # строки сохраняем как есть (labs) — handoff нормализует их вместе со всеми файлами случая
+    if lab_rows:
+        # компактная таблица вместо страниц текста: handoff не цитирует покрытые ею страницы
+        await evidence_writer.write([ocr_evidence("lab", lab_norm.summary(lab_norm.normalize(lab_rows)), {
+            "type": "lab_table", "sha256": meta["sha256"], "rows": len(lab_rows), "pages": table_pages,
+            "labs": [asdict(r) for r in lab_rows],
+        })])
+    # находки матчера — кроме страниц, целиком переданных таблицей; повторы строк таблиц схлопнет lab_norm
+    covered = set(table_pages)
+    lab_hits = [r for r in lab_hits if r.page not in covered]
+    if lab_hits:
+        await evidence_writer.write([ocr_evidence("lab", lab_norm.summary(lab_norm.normalize(lab_hits)), {
+            "type": "lab_extract", "labs": [asdict(r) for r in lab_hits],
+        })])
 
     await state.clear()
     await m.answer(
@@ -225,6 +356,9 @@ async def on_file_payload(m: Message, state: FSMContext):
         f"Можно /add_file ещё или /review {case_id}."
     )
 
+def _case_quotes(case_id: str, user_id: int) -> list[str]:
+    return quoted_evidence(iter_evidence(case_id, user_id))
+
 @dp.message(Command("review"))
 async def on_review(m: Message):
     parts = (m.text or "").split()
@@ -238,31 +372,61 @@ async def on_review(m: Message):
         case_id = parts[1].strip()
 
     user_id = m.from_user.id
-    evs = load_evidence(case_id, user_id)
-    if not evs:
+    await evidence_writer.flush()  # в режиме "interval" свежие ответы могут быть ещё в очереди
+    # чтение лога, дедуп блобов и lab_norm — в потоке, чтобы не стоял event loop
+    quotes = await asyncio.to_thread(_case_quotes, case_id, user_id)
+    if not quotes:
         await m.answer("Не нашёл доказательств для этого дела. Сначала /new и ответы на вопросы.")
         return
 
-    quotes = quoted_evidence(evs)
-    await m.answer("🧠 Анализирую кейс…")
+    t0 = time.monotonic()
+    status = await m.answer("🧠 Анализирую кейс…")
 
     try:
-        assessment = analyze_case(case_id, quotes)  # STRICT JSON от модели
-        friendly = friendly_message(assessment)     # дружелюбный текст
+        assessment = await analyze_case_async(case_id, quotes)  # STRICT JSON от модели
     except Exception as e:
         await m.answer(f"❌ Ошибка при обращении к модели:\n<code>{escape(str(e))}</code>")
         return
+    t_analyze = time.monotonic() - t0
+
+    # дружелюбный текст — потоком: правим одно сообщение по мере генерации
+    header = "<b>Клиническое резюме</b>\n"
+    room = TELEGRAM_TEXT_LIMIT - len(header) - 2
+    friendly = ""
+    complete = True
+    last_edit = 0.0
+    ttft = None
+    try:
+        async for delta in friendly_message_stream(assessment):
+            friendly += delta
+            status, last_edit, shown = await _show_progress(
+                m, status, last_edit, f"{header}{_clip_html(friendly, room)} ▌", final=False)
+            if shown and ttft is None:
+                ttft = time.monotonic() - t0
+    except Exception as e:
+        log.warning("review %s: friendly stream broke after %d chars: %s", case_id, len(friendly), e)
+        complete = False
 
     pkg = package_outputs(case_id, assessment, friendly)
 
     json_str = json.dumps(pkg["clinical_json"], ensure_ascii=False, indent=2)
     json_html = escape(json_str)
+    json_part = f"\n\n<code>JSON:</code>\n<pre language=\"json\">{json_html}</pre>"
+    tail = "" if complete else "\n\n<i>⚠️ Ответ оборвался — текст выше неполный.</i>"
 
-    await m.answer(
-        "<b>Клиническое резюме</b>\n"
-        + friendly
-        + f"\n\n<code>JSON:</code>\n<pre language=\"json\">{json_html}</pre>"
-    )
+    body = escape(friendly)
+    if len(header) + len(body) + len(tail) + len(json_part) <= TELEGRAM_TEXT_LIMIT:
+        await _show_progress(m, status, last_edit, header + body + tail + json_part, final=True)
+    else:
+        # одно сообщение не вмещает оба — JSON отдельным
+        body = _clip_html(friendly, TELEGRAM_TEXT_LIMIT - len(header) - len(tail))
+        await _show_progress(m, status, last_edit, header + body + tail, final=True)
+        await m.answer(json_part.strip())
+    if ttft is None:
+        ttft = time.monotonic() - t0
+    REVIEW_TTFT.append(ttft)
+    log.info("review %s: analyze %.2fs, first text %.2fs, total %.2fs",
+             case_id, t_analyze, ttft, time.monotonic() - t0)
 
 # Фоллбек: вне интейка — подсказка
 @dp.message(F.content_type == ContentType.TEXT)
@@ -273,7 +437,6 @@ async def on_free_text(m: Message):
     )
 
 def run() -> None:
-    import logging
     level = logging.DEBUG if config.DEBUG else logging.INFO
     logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     asyncio.run(dp.start_polling(bot))
@@ -1,32 +1,269 @@
 from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 from PIL import Image
 import pdfplumber
 import pytesseract
+from bot import config
 from .utils import normalize_text
+from . import ocr_lang, ocr_preprocess, ocr_select
 
+try:  # постоянный движок: модели загружаются один раз на поток
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
-def ocr_image(path: Path) -> str:
-    img = Image.open(path)
-    text = pytesseract.image_to_string(img, lang="eng+rus")  # extend langs as needed
+OCR_LANG = "eng+rus"  # extend langs as needed
+PDF_DPI = ocr_preprocess.PROFILES["pdf"].target_dpi or 300
+
+log = logging.getLogger("ocr")
+
+# решения и тайминги по страницам PDF; counted() отдаёт их в OcrPool
+PAGE_LOG: Deque[dict] = deque(maxlen=1000)
+
+
+# ---------------- Engines ----------------
+
+class OcrEngine:
+    name = "base"
+
+    def version(self) -> str:
+        raise NotImplementedError
+
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        raise NotImplementedError
+
+    def osd(self, img: Image.Image) -> Tuple[Optional[str], float]:
+        """(script, confidence) по OSD; ошибки — исключение."""
+        raise NotImplementedError
+
+
+class PytesseractEngine(OcrEngine):
+    """Каждый вызов — новый процесс tesseract, загрузка модели и временные файлы."""
+
+    name = "pytesseract"
+
+    def version(self) -> str:
+        try:
+            return str(pytesseract.get_tesseract_version())
+        except Exception:
+            return "unknown"
+
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        return pytesseract.image_to_string(img, lang=lang)
+
+    def osd(self, img: Image.Image) -> Tuple[Optional[str], float]:
+        d = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT)
+        return d.get("script"), float(d.get("script_conf", 0))
+
+
+class TesserocrEngine(OcrEngine):
+    """libtesseract в процессе: TessBaseAPI на каждый (поток, язык) живёт, пока жив процесс.
+
+    TessBaseAPI не потокобезопасен, поэтому экземпляры — thread-local; GIL
+    на время распознавания tesserocr отпускает.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _api(self, lang: str, psm) -> "tesserocr.PyTessBaseAPI":
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+        api = apis.get((lang, psm))
+        if api is None:
+            api = apis[(lang, psm)] = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+        return api
+
+    def version(self) -> str:
+        return tesserocr.tesseract_version().split()[1]
+
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        api = self._api(lang, tesserocr.PSM.AUTO)
+        api.SetImage(img)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def osd(self, img: Image.Image) -> Tuple[Optional[str], float]:
+        api = self._api("osd", tesserocr.PSM.OSD_ONLY)
+        api.SetImage(img)
+        try:
+            d = api.DetectOrientationScript()
+        finally:
+            api.Clear()
+        if not d:
+            return None, 0.0
+        return d.get("script_name"), float(d.get("script_conf", 0))
+
+
+ENGINES: Dict[str, Callable[[], OcrEngine]] = {
+    "pytesseract": PytesseractEngine,
+    "tesserocr": TesserocrEngine,
+}
+
+_ENGINE: OcrEngine | None = None
+_ENGINE_VERSION: str | None = None
+
+
+def engine() -> OcrEngine:
+    """OCR_ENGINE: "pytesseract" | "tesserocr" | "auto" (tesserocr, если установлен)."""
+    global _ENGINE
+    if _ENGINE is None:
+        name = config.OCR_ENGINE
+        if name == "auto":
+            name = "tesserocr" if tesserocr is not None else "pytesseract"
+        if name not in ENGINES:
+            raise ValueError(f"Unknown OCR_ENGINE: {config.OCR_ENGINE!r}")
+        if name == "tesserocr" and tesserocr is None:
+            raise RuntimeError("OCR_ENGINE=tesserocr, but tesserocr is not installed")
+        _ENGINE = ENGINES[name]()
+    return _ENGINE
+
+
+def engine_version() -> str:
+    global _ENGINE_VERSION
+    if _ENGINE_VERSION is None:
+        _ENGINE_VERSION = engine().version()
+    return _ENGINE_VERSION
+
+
+def settings_key() -> str:
+    """Всё, от чего зависит результат OCR, — часть ключа кэша OCR."""
+    return (
+        f"{engine().name}={engine_version()}|lang={OCR_LANG}|dpi={PDF_DPI}"
+        f"|px={config.OCR_MAX_PIXELS}|pages={config.OCR_MAX_PAGES}"
+        f"|prep={ocr_preprocess.settings_key()}|script={ocr_lang.settings_key()}"
+        f"|select={ocr_select.settings_key()}"
+    )
+
+
+def _recognize(img: Image.Image, hint: str = "") -> str:
+    eng = engine()
+    return eng.image_to_string(img, ocr_lang.choose(img, eng.osd, hint) or OCR_LANG)
+
+
+def ocr_image(path: Path, source: str = "image") -> str:
+    """source — профиль предобработки: "photo" (фото из Telegram) или "image"."""
+    with Image.open(path) as img:
+        text = _recognize(ocr_preprocess.prepare(img, source))
     return normalize_text(text)
 
 
-def parse_pdf(path: Path) -> Tuple[str, List[Tuple[int, str]]]:
-    """Return (full_text, per_page list[(page_index, text)])
-    Uses embedded text if present; falls back to OCR per page when empty.
+def _ocr_page(img: Image.Image, hint: str = "") -> str:
+    """hint — текстовый слой этой же страницы (гибридная страница: OCR только областей-картинок);
+    при OCR всей страницы он пуст, и язык остаётся OCR_LANG."""
+    return _recognize(ocr_preprocess.prepare(img, "pdf"), hint)
+
+
+def _reset_peak_rss() -> None:
+    try:  # Linux: "5" сбрасывает VmHWM процесса
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    """Пик RSS процесса с последнего _reset_peak_rss (без /proc — за всё время жизни)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:  # Windows
+        return 0.0
+
+
+def counted(fn: Callable[..., Any], *args: Any) -> Tuple[Any, dict]:
+    """fn(*args) и отчёт о вызове для OcrPool: прирост ocr_lang.STATS, пик RSS, PAGE_LOG."""
+    before = Counter(ocr_lang.STATS)
+    PAGE_LOG.clear()
+    _reset_peak_rss()
+    result = fn(*args)
+    report = {
+        "lang": dict(ocr_lang.STATS - before),
+        "peak_rss_mb": peak_rss_mb(),
+        "pages": list(PAGE_LOG),
+    }
+    PAGE_LOG.clear()
+    return result, report
+
+
+def single_threaded() -> None:
+    """tesseract сам плодит OpenMP-потоки — при параллельных страницах это только мешает."""
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def _plan_page(page) -> Tuple[str, List[Image.Image], ocr_select.PageDecision, float]:
+    """Текстовый слой, картинки для OCR (вся страница или области) и решение.
+
+    Рендер — здесь же, в процессе, который открыл PDF (pdfium не потокобезопасен).
     """
-    full = []
-    per_page: List[Tuple[int, str]] = []
+    t0 = time.perf_counter()
+    text = page.extract_text() or ""
+    d = ocr_select.decide(page, text)
+    if d.mode == "ocr":
+        text, imgs = "", [_render(page)]
+    elif d.mode == "hybrid":
+        imgs = [_render(page.crop(b)) for b in d.regions]
+    else:
+        imgs = []
+    return text, imgs, d, time.perf_counter() - t0
+
+
+def _finish_page(page_no: int, text: str, imgs: List[Image.Image], d: ocr_select.PageDecision,
+                 plan_s: float) -> str:
+    t0 = time.perf_counter()
+    parts = [text] + [_ocr_page(img, text) for img in imgs]
+    ocr_s = time.perf_counter() - t0
+    rec = {
+        "page": page_no, "mode": d.mode, "garbage": round(d.garbage, 3), "coverage": round(d.coverage, 3),
+        "regions": len(d.regions), "ocr_area": round(d.ocr_area, 3),
+        "plan_ms": round(plan_s * 1000, 1), "ocr_ms": round(ocr_s * 1000, 1),
+    }
+    PAGE_LOG.append(rec)
+    log.debug("page %(page)d: %(mode)s garbage=%(garbage)s coverage=%(coverage)s regions=%(regions)d "
+              "plan=%(plan_ms)sms ocr=%(ocr_ms)sms", rec)
+    return "\n".join(p for p in parts if p.strip())
+
+
+def _render(page) -> Image.Image:
+    """Растр страницы для OCR: PDF_DPI, но не больше OCR_MAX_PIXELS (огромные форматы — реже)."""
+    area_in2 = (float(page.width) / 72) * (float(page.height) / 72)
+    dpi = PDF_DPI
+    if config.OCR_MAX_PIXELS > 0 and area_in2 * dpi * dpi > config.OCR_MAX_PIXELS:
+        dpi = max(72, int((config.OCR_MAX_PIXELS / area_in2) ** 0.5))
+    return page.to_image(resolution=dpi).original
+
+
+def page_budget(total: int) -> int:
+    """Сколько страниц из total обрабатываем (OCR_MAX_PAGES, 0 — все)."""
+    return min(total, config.OCR_MAX_PAGES) if config.OCR_MAX_PAGES > 0 else total
+
+
+def pdf_page_count(path: Path) -> int:
     with pdfplumber.open(path) as pdf:
-        for i, page in enumerate(pdf.pages):
-            t = page.extract_text() or ""
-            if not t.strip():
-                # OCR rasterized page
-                img = page.to_image(resolution=300).original  # PIL image
-                t = pytesseract.image_to_string(img, lang="eng+rus")
-            t = normalize_text(t)
-            per_page.append((i + 1, t))
-            full.append(t)
-    return normalize_text("\n\n".join(full)), per_page
\ No newline at end of file
+        return len(pdf.pages)
+
+
+def pdf_page(path: Path, index: int) -> str:
+    """Текст одной страницы (index с 0) — единица работы OcrPool.iter_pdf."""
+    # pages=[...] — pdfplumber разбирает только эту страницу, а не весь документ
+    with pdfplumber.open(path, pages=[index + 1]) as pdf:
+        text, imgs, d, plan_s = _plan_page(pdf.pages[0])
+    return normalize_text(_finish_page(index + 1, text, imgs, d, plan_s))
@@ -0,0 +1,116 @@
+# bot/ocr_cache.py
+"""Персистентный кэш результатов OCR по sha256 загрузки.
+
+Ключ — sha256 файла + ocr.settings_key() (версия tesseract, языки, DPI),
+так что смена настроек не отдаёт старый текст. Значения — JSON-файлы в
+OCR_CACHE_DIR/<k[:2]>/<k>.json; при превышении OCR_CACHE_MAX_MB удаляются
+самые давно использованные (mtime обновляется на каждом попадании).
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+from bot import config
+
+log = logging.getLogger("ocr_cache")
+
+
+class OcrCache:
+    def __init__(self, root: Path | None = None, max_bytes: int | None = None):
+        self.root = Path(root or config.OCR_CACHE_DIR)
+        self.max_bytes = config.OCR_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def key(self, sha256: str, kind: str, settings: str) -> str:
+        return hashlib.sha256(f"{sha256}|{kind}|{settings}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Any:
+        if not self.enabled:
+            return None
+        p = self._path(key)
+        try:
+            value = json.loads(p.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(p)  # LRU по mtime
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        p = self._path(key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        old = p.stat().st_size if p.exists() else 0
+        os.replace(tmp, p)
+        with self._lock:
+            self.puts += 1
+            self._size = self._current_size() + len(data) - old
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _current_size(self) -> int:
+        if self._size is None:
+            self._size = sum(f.stat().st_size for f in self.root.rglob("*.json"))
+        return self._size
+
+    def _evict(self) -> None:
+        """Удаляет самые старые по mtime записи, пока не влезем в 90% лимита."""
+        files = []
+        for f in self.root.rglob("*.json"):
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+        files.sort()
+        total = sum(sz for _, sz, _ in files)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, sz, f in files:
+            if total <= target:
+                break
+            f.unlink(missing_ok=True)
+            total -= sz
+            removed += 1
+        with self._lock:
+            self._size = total
+            self.evictions += removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "puts": self.puts,
+                "evictions": self.evictions,
+                "bytes": self._size,
+            }
@@ -0,0 +1,84 @@
+# bot/ocr_lang.py
+"""Выбор языка tesseract для страницы.
+
+"eng+rus" заставляет tesseract гонять обе модели на каждой строке. Большинство
+страниц — в одной письменности, поэтому сначала быстро определяем её по уже
+извлечённому текстовому слою. Одна модель берётся, только если в нём
+практически одна письменность; смешанные страницы и страницы без текстового
+слоя идут с OCR_LANG. OSD движка (--psm 0, на уменьшенной копии) видит лишь
+доминирующую письменность — русский бланк с латинскими WBC/ALT/mmol/L ушёл бы
+в "rus", — поэтому для сканов он только по OCR_SCRIPT_OSD. STATS считает,
+какой путь был выбран ("text_layer:eng", "mixed", "no_text_layer", "osd:rus", ...).
+"""
+from __future__ import annotations
+import re
+from collections import Counter
+from typing import Callable, Optional, Tuple
+
+from PIL import Image
+import pytesseract
+
+from bot import config
+
+SCRIPT_LANGS = {"Latin": "eng", "Cyrillic": "rus"}
+MIN_LETTERS = 40        # меньше букв — по тексту не судим
+OSD_SIDE = 1600         # OSD хватает уменьшенной копии
+
+_LATIN_RE = re.compile(r"[A-Za-z]")
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+
+STATS: Counter = Counter()
+
+
+def script_of_text(text: str) -> Optional[str]:
+    """"Latin" / "Cyrillic" при доле букв >= OCR_SCRIPT_MIN_SHARE, "mixed" иначе, None — мало букв."""
+    lat = len(_LATIN_RE.findall(text))
+    cyr = len(_CYRILLIC_RE.findall(text))
+    if lat + cyr < MIN_LETTERS:
+        return None
+    share = config.OCR_SCRIPT_MIN_SHARE
+    if cyr >= share * (lat + cyr):
+        return "Cyrillic"
+    if lat >= share * (lat + cyr):
+        return "Latin"
+    return "mixed"
+
+
+def script_of_image(img: Image.Image, osd: Callable[[Image.Image], Tuple[Optional[str], float]]) -> Optional[str]:
+    """OSD движка OCR; None — не смогли или не уверены."""
+    small = img.copy()
+    small.thumbnail((OSD_SIDE, OSD_SIDE))
+    try:
+        script, conf = osd(small)
+    except (pytesseract.TesseractError, RuntimeError):
+        return None  # нет osd.traineddata или слишком мало текста
+    if conf < config.OCR_SCRIPT_MIN_CONF:
+        return None
+    return script
+
+
+def choose(img: Image.Image, osd: Callable[[Image.Image], Tuple[Optional[str], float]], hint: str = "") -> Optional[str]:
+    """Один язык tesseract для страницы или None — распознавать комбинированной моделью."""
+    if not config.OCR_SCRIPT_DETECT:
+        STATS["disabled"] += 1
+        return None
+    script = script_of_text(hint) if hint else None
+    path = "text_layer"
+    if script is None:
+        if not config.OCR_SCRIPT_OSD:
+            STATS["no_text_layer"] += 1
+            return None
+        script, path = script_of_image(img, osd), "osd"
+    lang = SCRIPT_LANGS.get(script or "")
+    if lang is None:
+        STATS["mixed" if script == "mixed" else f"{path}_unsure"] += 1
+        return None
+    STATS[f"{path}:{lang}"] += 1
+    return lang
+
+
+def settings_key() -> str:
+    if not config.OCR_SCRIPT_DETECT:
+        return "off"
+    osd = f",conf={config.OCR_SCRIPT_MIN_CONF}" if config.OCR_SCRIPT_OSD else ",osd=off"
+    return f"share={config.OCR_SCRIPT_MIN_SHARE}{osd}"
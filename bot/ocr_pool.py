@@ -0,0 +1,196 @@
+# bot/ocr_pool.py
+"""OCR в отдельных процессах, чтобы tesseract не замораживал event loop.
+
+Хендлеры делают `await ocr_pool.parse_pdf(path)`; работа уходит в
+ProcessPoolExecutor на OCR_WORKERS процессов. Если в работе и в очереди уже
+OCR_QUEUE_MAX задач — сразу OcrQueueFull, и бот просит прислать файл позже,
+а не копит бесконечную очередь. Перед отправкой в пул смотрим OcrCache:
+повторно присланный файл не распознаётся заново.
+
+iter_pdf — потоковый вариант parse_pdf: страницы уходят в пул отдельными
+задачами (до OCR_PAGE_WORKERS одновременно) и отдаются по порядку по мере
+готовности, так что хендлер может сохранять их и показывать прогресс сразу.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Deque, List, Optional, Tuple
+
+from bot import config
+from . import lab_extract, ocr
+from .ocr_cache import OcrCache
+from .utils import normalize_text, sha256_of
+
+log = logging.getLogger("ocr_pool")
+
+
+class OcrQueueFull(RuntimeError):
+    pass
+
+
+class OcrPool:
+    def __init__(
+        self,
+        workers: int | None = None,
+        queue_max: int | None = None,
+        page_workers: int | None = None,
+        cache: OcrCache | None = None,
+    ):
+        self.workers = workers or config.OCR_WORKERS
+        self.queue_max = config.OCR_QUEUE_MAX if queue_max is None else queue_max
+        self.page_workers = page_workers or config.OCR_PAGE_WORKERS
+        self.cache = cache or OcrCache()
+        self.lang_stats: Counter = Counter()  # выбор языка tesseract (ocr_lang), суммарно по воркерам
+        self.peak_rss_mb = 0.0  # максимальный пик RSS воркера за одну задачу
+        self.page_modes: Counter = Counter()  # text / hybrid / ocr по страницам PDF (ocr_select)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.pending = 0  # в работе + в очереди
+        self.rejected = 0
+        self.restarts = 0  # сколько раз пул пересоздавали после смерти воркера
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: форк процесса с живыми потоками (writer, loop) небезопасен
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=ocr.single_threaded if self.page_workers > 1 else None,
+            )
+        return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        """Воркер умер (OOM на большом скане) — пул сломан навсегда; следующий вызов поднимет новый."""
+        if self._pool is pool:
+            self._pool = None
+            self.restarts += 1
+            log.warning("ocr pool is broken (worker died), restarting on next call")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _admit(self) -> None:
+        if self.pending >= self.queue_max:
+            self.rejected += 1
+            raise OcrQueueFull(f"OCR queue is full ({self.pending}/{self.queue_max})")
+        self.pending += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        self._admit()
+        usage: dict = {}
+        try:
+            return await self._call(fn, *args, usage=usage)
+        finally:
+            self.pending -= 1
+            log.info("ocr %s: peak worker RSS %.0f MB", fn.__name__, usage.get("peak_rss_mb", 0.0))
+
+    async def _call(self, fn: Callable[..., Any], *args: Any, usage: Optional[dict] = None) -> Any:
+        """fn в процессе пула; usage["peak_rss_mb"] — максимум пика RSS воркеров по вызовам одной загрузки."""
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        try:
+            result, report = await loop.run_in_executor(pool, ocr.counted, fn, *args)
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+        self.lang_stats.update(report["lang"])
+        peak = report["peak_rss_mb"]
+        self.peak_rss_mb = max(self.peak_rss_mb, peak)
+        for rec in report["pages"]:
+            self.page_modes[rec["mode"]] += 1
+            log.debug("ocr page %s", rec)
+        if usage is not None:
+            usage["peak_rss_mb"] = max(usage.get("peak_rss_mb", 0.0), peak)
+            usage.setdefault("pages", []).extend(report["pages"])
+        return result
+
+    async def _cache_key(self, kind: str, path: Path, sha256: str | None) -> Optional[str]:
+        if not self.cache.enabled:
+            return None
+        if sha256 is None:
+            sha256 = sha256_of(await asyncio.to_thread(path.read_bytes))
+        # первый вызов settings_key() спрашивает версию у tesseract — не в event loop
+        settings = await asyncio.to_thread(ocr.settings_key)
+        return self.cache.key(sha256, kind, settings)
+
+    async def _cached(self, kind: str, path: Path, sha256: str | None, compute):
+        key = await self._cache_key(kind, path, sha256)
+        if key is None:
+            return await compute()
+        hit = await asyncio.to_thread(self.cache.get, key)
+        if hit is not None:
+            return hit
+        value = await compute()
+        await asyncio.to_thread(self.cache.put, key, value)
+        return value
+
+    async def ocr_image(self, path: Path, sha256: str | None = None, source: str = "image") -> str:
+        return await self._cached(source, path, sha256, lambda: self.run(ocr.ocr_image, path, source))
+
+    async def parse_pdf(self, path: Path, sha256: str | None = None) -> Tuple[str, List[Tuple[int, str]]]:
+        per_page = [(i, t) async for i, _, t in self.iter_pdf(path, sha256)]
+        return normalize_text("\n\n".join(t for _, t in per_page)), per_page
+
+    async def iter_pdf(self, path: Path, sha256: str | None = None) -> AsyncIterator[Tuple[int, int, str]]:
+        """(номер страницы, всего страниц, текст) — по порядку страниц, по мере готовности."""
+        key = await self._cache_key("pdf", path, sha256)
+        hit = await asyncio.to_thread(self.cache.get, key) if key else None
+        if hit is not None:
+            total = hit.get("total", len(hit["per_page"]))
+            for i, t in hit["per_page"]:
+                yield int(i), total, t
+            return
+
+        self._admit()  # весь PDF — одно место в очереди, как и в parse_pdf
+        window: Deque[asyncio.Future] = deque()
+        pages: Optional[List[Tuple[int, str]]] = [] if key else None  # копия страниц — только для кэша
+        done = 0
+        usage: dict = {}
+        total = 0
+        try:
+            total = await self._call(ocr.pdf_page_count, path, usage=usage)
+            budget = ocr.page_budget(total)  # дальше бюджета не читаем; total — для «стр. N из M»
+            submitted = 0
+            while submitted < budget or window:
+                while submitted < budget and len(window) < self.page_workers:
+                    window.append(asyncio.ensure_future(self._call(ocr.pdf_page, path, submitted, usage=usage)))
+                    submitted += 1
+                text = await window.popleft()
+                done += 1
+                if pages is not None:
+                    pages.append((done, text))
+                yield done, total, text
+        finally:
+            self.pending -= 1
+            for fut in window:  # хендлер прервал чтение — оставшиеся страницы не нужны
+                fut.cancel()
+            recs = usage.get("pages", [])
+            modes = Counter(r["mode"] for r in recs)
+            log.info(
+                "ocr pdf %s: %d/%d pages (text=%d hybrid=%d ocr=%d, OCR area %.0f%% of pages, OCR %.1fs), "
+                "peak worker RSS %.0f MB",
+                path.name, done, total, modes["text"], modes["hybrid"], modes["ocr"],
+                100 * sum(r["ocr_area"] for r in recs) / max(1, len(recs)),
+                sum(r["ocr_ms"] for r in recs) / 1000, usage.get("peak_rss_mb", 0.0),
+            )
+
+        if key:
+            # полный текст не кладём: parse_pdf склеивает его из per_page
+            await asyncio.to_thread(self.cache.put, key, {"per_page": pages, "total": total})
+
+    async def lab_tables(self, path: Path) -> Tuple[List["lab_extract.LabRow"], List[int]]:
+        """Таблицы анализов из слоя PDF (lab_extract.extract_tables) — тоже в пуле, тоже в очереди."""
+        return await self.run(lab_extract.extract_tables, path, config.OCR_MAX_PAGES)
+
+    async def close(self) -> None:
+        if self._pool is None:
+            log.info("ocr cache: %s", self.cache.stats())
+            return
+        pool, self._pool = self._pool, None
+        await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+        log.info(
+            "ocr pool closed (rejected=%d, restarts=%d, cache=%s, lang=%s, pages=%s, peak_rss_mb=%.0f)",
+            self.rejected, self.restarts, self.cache.stats(), dict(self.lang_stats), dict(self.page_modes), self.peak_rss_mb,
+        )
@@ -0,0 +1,132 @@
+# bot/ocr_preprocess.py
+"""Подготовка картинки перед tesseract.
+
+Фото из Telegram обычно огромные, цветные и повёрнутые по EXIF — tesseract
+тратит на них больше времени, чем на распознавание. Конвейер:
+EXIF-поворот → оттенки серого → уменьшение до OCR_TARGET_DPI (считаем, что
+длинная сторона — это A4) → опционально бинаризация (Otsu) и выравнивание
+наклона. Что включено, задаётся по источнику: "photo" (фото из Telegram),
+"image" (картинка документом), "pdf" (отрендеренная страница PDF).
+Только Pillow, без numpy.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, List
+
+from PIL import Image, ImageOps
+
+from bot import config
+
+A4_LONG_IN = 11.69
+DESKEW_MAX_DEG = 5.0
+DESKEW_STEP_DEG = 0.5
+DESKEW_THUMB = 800  # угол ищем на уменьшенной копии
+
+
+@dataclass(frozen=True)
+class Profile:
+    grayscale: bool = True
+    target_dpi: int = 300
+    binarize: bool = False
+    deskew: bool = False
+
+    def key(self) -> str:
+        return f"gray={int(self.grayscale)},dpi={self.target_dpi},bin={int(self.binarize)},deskew={int(self.deskew)}"
+
+
+def _profile(source: str) -> Profile:
+    if not config.OCR_PREPROCESS:
+        return Profile(grayscale=False, target_dpi=0)
+    return Profile(
+        target_dpi=config.OCR_TARGET_DPI,
+        binarize=source in config.OCR_BINARIZE,
+        deskew=source in config.OCR_DESKEW,
+    )
+
+
+PROFILES: Dict[str, Profile] = {s: _profile(s) for s in ("photo", "image", "pdf")}
+
+
+def settings_key() -> str:
+    """Часть ключа кэша OCR: смена профилей должна давать новый результат."""
+    return ";".join(f"{s}:{p.key()}" for s, p in sorted(PROFILES.items()))
+
+
+def downscale(img: Image.Image, target_dpi: int) -> Image.Image:
+    if target_dpi <= 0:
+        return img
+    max_side = int(target_dpi * A4_LONG_IN)
+    w, h = img.size
+    if max(w, h) <= max_side:
+        return img  # увеличивать не будем — деталей от этого не прибавится
+    scale = max_side / max(w, h)
+    return img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+
+
+def otsu_threshold(img: Image.Image) -> int:
+    hist = img.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * n for i, n in enumerate(hist))
+    w_bg = sum_bg = 0
+    best_t, best_var = 127, -1.0
+    for t, n in enumerate(hist):
+        w_bg += n
+        if w_bg == 0:
+            continue
+        w_fg = total - w_bg
+        if w_fg == 0:
+            break
+        sum_bg += t * n
+        m_bg = sum_bg / w_bg
+        m_fg = (sum_all - sum_bg) / w_fg
+        var = w_bg * w_fg * (m_bg - m_fg) ** 2
+        if var > best_var:
+            best_t, best_var = t, var
+    return best_t
+
+
+def binarize(img: Image.Image) -> Image.Image:
+    t = otsu_threshold(img)
+    return img.point(lambda v: 255 if v > t else 0)
+
+
+def _row_profile_score(img: Image.Image) -> float:
+    # средние по строкам: ресайз до ширины 1 пикселя (BOX) — без numpy
+    rows: List[int] = list(img.resize((1, img.height), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((r - mean) ** 2 for r in rows)
+
+
+def skew_angle(img: Image.Image) -> float:
+    """Угол, при котором строки текста горизонтальны (максимум дисперсии профиля строк)."""
+    thumb = ImageOps.invert(img.convert("L"))  # текст светлый на чёрном — поворот добавит фон 0
+    thumb.thumbnail((DESKEW_THUMB, DESKEW_THUMB))
+
+    def best_of(angles) -> float:
+        return max(angles, key=lambda a: _row_profile_score(thumb.rotate(a, resample=Image.BILINEAR)))
+
+    # грубо с шагом DESKEW_STEP_DEG, потом уточняем с шагом 0.1°
+    steps = int(DESKEW_MAX_DEG / DESKEW_STEP_DEG)
+    coarse = best_of([k * DESKEW_STEP_DEG for k in range(-steps, steps + 1)])
+    fine = int(DESKEW_STEP_DEG * 10)
+    return round(best_of([coarse + k / 10 for k in range(-fine, fine + 1)]), 1)
+
+
+def deskew(img: Image.Image) -> Image.Image:
+    a = skew_angle(img)
+    if not a:
+        return img
+    return img.rotate(a, resample=Image.BICUBIC, expand=True, fillcolor="white")
+
+
+def prepare(img: Image.Image, source: str = "image", profile: Profile | None = None) -> Image.Image:
+    p = profile or PROFILES.get(source) or PROFILES["image"]
+    img = ImageOps.exif_transpose(img)
+    if p.grayscale:
+        img = img.convert("L")
+    img = downscale(img, p.target_dpi)
+    if p.deskew:
+        img = deskew(img)
+    if p.binarize:
+        img = binarize(img.convert("L"))
+    return img
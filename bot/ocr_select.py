@@ -0,0 +1,96 @@
+# bot/ocr_select.py
+"""Какие страницы PDF (и какие их части) отдавать в OCR.
+
+Раньше страница считалась сканом только при пустом extract_text(). Теперь
+текстовый слой оценивается:
+- garbage — доля мусора: (cid:N) без ToUnicode, U+FFFD, private use и
+  прочие символы вне кириллицы/латиницы/цифр/обычной пунктуации;
+- coverage — доля «содержимого» страницы (площадь глифов + площадь
+  картинок без текста поверх), которая приходится на глифы.
+
+Решение: "text" — слой годный, OCR не нужен; "ocr" — слоя нет, он мусорный
+или страница — почти целиком картинка с подписью; "hybrid" — слой годный,
+но есть крупные картинки без текста поверх: OCR только их (regions).
+"""
+from __future__ import annotations
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from bot import config
+
+BBox = Tuple[float, float, float, float]  # x0, top, x1, bottom (pt)
+
+MIN_CHARS_OVER_IMAGE = 10  # столько символов поверх картинки — это уже «searchable PDF»
+
+_CID_RE = re.compile(r"\(cid:\d+\)")
+_GOOD_RE = re.compile(r"[A-Za-zА-Яа-яЁё0-9.,:;!?()\[\]{}<>\-–—+*/\\=%№#&'\"«»…^_|~@$°±×µ·]")
+
+
+@dataclass
+class PageDecision:
+    mode: str  # "text" | "ocr" | "hybrid"
+    garbage: float
+    coverage: float
+    regions: List[BBox] = field(default_factory=list)
+    ocr_area: float = 0.0  # доля площади страницы, которая пойдёт в OCR
+
+
+def garbage_ratio(text: str) -> float:
+    cids = len(_CID_RE.findall(text))
+    rest = [c for c in _CID_RE.sub("", text) if not c.isspace()]
+    n = cids + len(rest)
+    if n == 0:
+        return 1.0
+    good = sum(1 for c in rest if _GOOD_RE.match(c))
+    return (n - good) / n
+
+
+def _area(b: BBox) -> float:
+    return max(0.0, b[2] - b[0]) * max(0.0, b[3] - b[1])
+
+
+def _clamp(b: BBox, page_bbox: BBox) -> BBox:
+    return (max(b[0], page_bbox[0]), max(b[1], page_bbox[1]), min(b[2], page_bbox[2]), min(b[3], page_bbox[3]))
+
+
+def uncovered_images(page) -> List[BBox]:
+    """Крупные картинки страницы, поверх которых почти нет текстового слоя."""
+    page_bbox = tuple(float(v) for v in page.bbox)
+    min_area = config.OCR_MIN_REGION * _area(page_bbox)
+    out: List[BBox] = []
+    for im in page.images:
+        b = _clamp((float(im["x0"]), float(im["top"]), float(im["x1"]), float(im["bottom"])), page_bbox)
+        if _area(b) < min_area:
+            continue  # логотипы, печати, подписи
+        inside = sum(
+            1 for c in page.chars
+            if b[0] <= (c["x0"] + c["x1"]) / 2 <= b[2] and b[1] <= (c["top"] + c["bottom"]) / 2 <= b[3]
+        )
+        if inside < MIN_CHARS_OVER_IMAGE:
+            out.append(b)
+    return out
+
+
+def glyph_coverage(page, regions: List[BBox]) -> float:
+    glyphs = sum(_area((float(c["x0"]), float(c["top"]), float(c["x1"]), float(c["bottom"]))) for c in page.chars)
+    content = glyphs + sum(_area(b) for b in regions)
+    return glyphs / content if content else 0.0
+
+
+def decide(page, text: Optional[str]) -> PageDecision:
+    page_area = _area(tuple(float(v) for v in page.bbox)) or 1.0
+    if not text or not text.strip():
+        return PageDecision("ocr", 1.0, 0.0, ocr_area=1.0)
+    garbage = garbage_ratio(text)
+    regions = uncovered_images(page)
+    coverage = glyph_coverage(page, regions)
+    if garbage > config.OCR_GARBAGE_MAX or (regions and coverage < config.OCR_MIN_COVERAGE):
+        return PageDecision("ocr", garbage, coverage, ocr_area=1.0)
+    if regions:
+        return PageDecision("hybrid", garbage, coverage, regions, sum(_area(b) for b in regions) / page_area)
+    return PageDecision("text", garbage, coverage)
+
+
+def settings_key() -> str:
+    return f"garbage={config.OCR_GARBAGE_MAX},cov={config.OCR_MIN_COVERAGE},region={config.OCR_MIN_REGION}"
@@ -1,29 +1,14 @@
 # bot/reviewer.py
 from __future__ import annotations
 import json, re, logging
-from typing import List
-import httpx
-from openai import OpenAI
+import time
+from typing import AsyncIterator, List
 from bot import config
+from . import llm_http
 from .prompts import SYSTEM_REASONING, SYSTEM_FRIENDLY
 
 log = logging.getLogger("reviewer")
 
-# Стабильный HTTP-клиент: без HTTP/2 и keep-alive (меньше проблем с сетями/прокси)
-transport = httpx.HTTPTransport(http2=False)
-_httpx = httpx.Client(
-    transport=transport,
-    timeout=30.0,
-    limits=httpx.Limits(max_keepalive_connections=0, max_connections=5),
-    headers={"Connection": "close"},
-)
-
-_client = OpenAI(
-    api_key=(config.OPENAI_API_KEY or "").strip(),
-    base_url=(config.OPENAI_BASE_URL or "https://api.openai.com/v1").strip(),
-    http_client=_httpx,
-)
-
 # ✅ Дефолты на случай, если в окружении пусто
 MODEL_REASONING = (getattr(config, "MODEL_REASONING", "") or "gpt-4o-mini").strip()
 MODEL_FRIENDLY  = (getattr(config, "MODEL_FRIENDLY", "")  or "gpt-4o-mini").strip()
@@ -43,7 +28,7 @@ def _strict_json_from_text(text: str) -> dict:
             return json.loads(m.group(0))
         raise RuntimeError(f"Model did not return valid JSON:\n{text}")
 
-def analyze_case(case_id: str, evidence_quotes: List[str]) -> dict:
+def _analyze_request(case_id: str, evidence_quotes: List[str]) -> dict:
     prompt = (
         "You will receive quoted evidence snippets for a single case.\n"
         "Return ONLY valid JSON per the provided schema. Do not add prose.\n\n"
@@ -52,24 +37,16 @@ def analyze_case(case_id: str, evidence_quotes: List[str]) -> dict:
     )
     model = _ensure_model(MODEL_REASONING, "reasoning")
     log.debug("analyze_case → model=%s", model)
+    return dict(
+        model=model,
+        input=[
+            {"role": "system", "content": SYSTEM_REASONING},
+            {"role": "user", "content": prompt},
+        ],
+        timeout=llm_http.timeout(config.LLM_TIMEOUT),
+    )
 
-    try:
-        res = _client.responses.create(
-            model=model,
-            input=[
-                {"role": "system", "content": SYSTEM_REASONING},
-                {"role": "user", "content": prompt},
-            ],
-            timeout=30,
-        )
-        text = res.output_text or ""
-        return _strict_json_from_text(text)
-    except Exception as e:
-        log.exception("analyze_case failed: %s", e)
-        raise
-
-def friendly_message(json_assessment: dict) -> str:
-    """Форматирует пациенту/врачу через Responses API."""
+def _friendly_request(json_assessment: dict) -> dict:
     content = json.dumps(json_assessment, ensure_ascii=False)
     prompt = (
         "Convert the following strict JSON clinical assessment into:\n"
@@ -79,18 +56,72 @@ def friendly_message(json_assessment: dict) -> str:
     )
     model = _ensure_model(MODEL_FRIENDLY, "friendly")
     log.debug("friendly_message → model=%s", model)
+    return dict(
+        model=model,
+        input=[
+            {"role": "system", "content": SYSTEM_FRIENDLY},
+            {"role": "user", "content": prompt},
+        ],
+        timeout=llm_http.timeout(config.LLM_TIMEOUT),
+    )
+
+FRIENDLY_FALLBACK = "Не удалось сформировать читабельное резюме ответа. Попробуйте ещё раз позже."
+
+def analyze_case(case_id: str, evidence_quotes: List[str]) -> dict:
+    try:
+        res = llm_http.sync_client().responses.create(**_analyze_request(case_id, evidence_quotes))
+        return _strict_json_from_text(res.output_text or "")
+    except Exception as e:
+        log.exception("analyze_case failed: %s", e)
+        raise
 
+async def analyze_case_async(case_id: str, evidence_quotes: List[str]) -> dict:
+    """analyze_case для хендлеров бота — через AsyncOpenAI."""
     try:
-        res = _client.responses.create(
-            model=model,
-            input=[
-                {"role": "system", "content": SYSTEM_FRIENDLY},
-                {"role": "user", "content": prompt},
-            ],
-            timeout=30,
-        )
+        res = await llm_http.async_client().responses.create(**_analyze_request(case_id, evidence_quotes))
+        return _strict_json_from_text(res.output_text or "")
+    except Exception as e:
+        log.exception("analyze_case failed: %s", e)
+        raise
+
+def friendly_message(json_assessment: dict) -> str:
+    """Форматирует пациенту/врачу через Responses API."""
+    try:
+        res = llm_http.sync_client().responses.create(**_friendly_request(json_assessment))
         return res.output_text or ""
     except Exception as e:
         log.exception("friendly_message failed: %s", e)
         # вернём короткое сообщение вместо падения хендлера
-        return "Не удалось сформировать читабельное резюме ответа. Попробуйте ещё раз позже."
+        return FRIENDLY_FALLBACK
+
+async def friendly_message_async(json_assessment: dict) -> str:
+    try:
+        res = await llm_http.async_client().responses.create(**_friendly_request(json_assessment))
+        return res.output_text or ""
+    except Exception as e:
+        log.exception("friendly_message failed: %s", e)
+        return FRIENDLY_FALLBACK
+
+async def friendly_message_stream(json_assessment: dict) -> AsyncIterator[str]:
+    """friendly_message кусками по мере генерации (стриминг Responses API).
+
+    Ошибка до первого куска — отдаём FRIENDLY_FALLBACK; после — пробрасываем,
+    чтобы вызывающий пометил оборванный текст.
+    """
+    t0 = time.monotonic()
+    sent = False
+    try:
+        stream = await llm_http.async_client().responses.create(**_friendly_request(json_assessment), stream=True)
+        async for event in stream:
+            if event.type == "response.output_text.delta" and event.delta:
+                if not sent:
+                    log.debug("friendly_message first delta in %.2fs", time.monotonic() - t0)
+                sent = True
+                yield event.delta
+            elif event.type in ("error", "response.failed", "response.incomplete"):
+                raise RuntimeError(getattr(event, "message", None) or event.type)
+    except Exception as e:
+        log.exception("friendly_message failed: %s", e)
+        if sent:
+            raise
+        yield FRIENDLY_FALLBACK
@@ -0,0 +1,159 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+# config требует токены — для локального бенчмарка они не нужны
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from dataclasses import asdict
+from bot.evidence_io import (
+    Evidence, JsonlEvidenceStore, append_evidence, scan_evidence, get_index,
+    encode_batch, decode_rows, decode_row,
+)
+from bot.evidence_codec import BlobCodec, save_dict, train_dict
+from bot.utils import now_iso
+
+USER_ID = 42
+FRAGMENT = "давящая боль в груди с отдачей в левую руку, 30 минут назад"
+
+
+def _fill(db: Path, start: int, stop: int, batch: int = 10_000) -> None:
+    ts = now_iso()
+    for lo in range(start, stop, batch):
+        append_evidence(
+            [
+                Evidence(f"case_{i % 50_000:06d}", USER_ID, "patient_text", FRAGMENT,
+                         {"type": "bench", "message_id": i}, ts)
+                for i in range(lo, min(lo + batch, stop))
+            ],
+            db_path=db,
+        )
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_index(sizes, repeat: int) -> None:
+    """Время load_evidence (индекс, mmap-префильтр) против полного скана при росте лога."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Path(tmp) / "evidence.jsonl"
+        done = 0
+        st = JsonlEvidenceStore(db, read_mode="index")
+        mm = JsonlEvidenceStore(db, read_mode="mmap")
+        print(f"{'lines':>10} {'indexed, ms':>12} {'cold open, ms':>14} {'mmap, ms':>10} {'full scan, ms':>14}")
+        for n in sizes:
+            _fill(db, done, n)
+            done = n
+            case_id = "case_000123"
+            hot = _time(lambda: st.load(case_id, USER_ID), repeat)
+            # холодный старт процесса: индекс читается с диска
+            get_index(db).forget()
+            t0 = time.perf_counter()
+            st.load(case_id, USER_ID)
+            cold = time.perf_counter() - t0
+            mmap_t = _time(lambda: mm.load(case_id, USER_ID), 3)
+            full = _time(lambda: scan_evidence(case_id, USER_ID, db_path=db), 1)
+            print(f"{n:>10} {hot * 1e3:>12.3f} {cold * 1e3:>14.1f} {mmap_t * 1e3:>10.1f} {full * 1e3:>14.1f}")
+
+
+def bench_codec(n: int, repeat: int) -> None:
+    """Кодек Evidence: байт на запись и записей/с, старый путь (asdict / Evidence(**row)) против нового."""
+    evs = [
+        Evidence(f"case_{i % 500:06d}", USER_ID, "ocr" if i % 3 else "patient_text", FRAGMENT,
+                 {"type": "upload", "page": i % 20, "sha256": "ab" * 32}, now_iso())
+        for i in range(n)
+    ]
+    old_enc = lambda: "".join(json.dumps(asdict(e), ensure_ascii=False) + "\n" for e in evs).encode("utf-8")
+    new_enc = lambda: encode_batch(evs)
+    old_blob, new_blob = old_enc(), new_enc()
+    old_lines, new_lines = old_blob.splitlines(), new_blob.splitlines()
+    old_dec = lambda: [Evidence(**json.loads(line)) for line in old_lines]
+    new_dec = lambda: [decode_row(r) for r in decode_rows(new_lines)]
+    print(f"{'codec':>8} {'bytes/rec':>10} {'encode rec/s':>14} {'decode rec/s':>14}")
+    for name, blob, enc, dec in (("asdict", old_blob, old_enc, old_dec), ("compact", new_blob, new_enc, new_dec)):
+        te, td = _time(enc, repeat), _time(dec, repeat)
+        print(f"{name:>8} {len(blob) / n:>10.1f} {n / te:>14,.0f} {n / td:>14,.0f}")
+
+
+_ANALYTES = [
+    ("Гемоглобин (HGB)", "г/л", "120-160"), ("Эритроциты (RBC)", "10^12/л", "3.8-5.3"),
+    ("Лейкоциты (WBC)", "10^9/л", "4.0-9.0"), ("Тромбоциты (PLT)", "10^9/л", "150-400"),
+    ("С-реактивный белок (CRP)", "мг/л", "0-5"), ("Креатинин (Creatinine)", "мкмоль/л", "62-106"),
+    ("Глюкоза (Glucose)", "ммоль/л", "3.9-6.1"), ("АЛТ (ALT)", "Ед/л", "0-41"),
+    ("АСТ (AST)", "Ед/л", "0-40"), ("Билирубин общий (Total bilirubin)", "мкмоль/л", "3.4-20.5"),
+    ("Ферритин (Ferritin)", "нг/мл", "30-400"), ("ТТГ (TSH)", "мМЕ/л", "0.4-4.0"),
+]
+
+
+def _lab_page(rng: random.Random) -> str:
+    """Синтетическая страница бланка: кириллица + латиница, как в наших OCR."""
+    head = (f"ООО «Лаборатория Здоровье» Лицензия № ЛО-77-01-{rng.randint(100000, 999999)} "
+            f"Пациент: Иванов И.И. Дата рождения: {rng.randint(1, 28):02d}.0{rng.randint(1, 9)}.19{rng.randint(50, 99)} "
+            f"Заказ № {rng.randint(10**7, 10**8)} Дата взятия: 0{rng.randint(1, 9)}.09.2025 Биоматериал: кровь венозная ")
+    rows = []
+    for name, unit, ref in rng.sample(_ANALYTES, k=rng.randint(6, len(_ANALYTES))):
+        lo, hi = (float(x) for x in ref.split("-"))
+        val = round(rng.uniform(lo * 0.6, hi * 1.4), 1)
+        flag = "↑" if val > hi else ("↓" if val < lo else "")
+        rows.append(f"{name} {val} {flag} {unit} {ref}")
+    tail = "Результаты исследований не являются диагнозом, необходима консультация специалиста. Врач КДЛ: Петрова А.С."
+    return head + "Исследование Результат Ед. изм. Референсные значения " + " ".join(rows) + " " + tail
+
+
+def bench_compress(n_pages: int, repeat: int) -> None:
+    """Степень сжатия OCR-страниц против стоимости декодирования (кириллица/латиница)."""
+    rng = random.Random(7)
+    pages = [_lab_page(rng) for _ in range(n_pages)]
+    train, test = pages[: n_pages // 2], [p.encode("utf-8") for p in pages[n_pages // 2 :]]
+    raw = sum(len(b) for b in test)
+    with tempfile.TemporaryDirectory() as tmp:
+        from bot import config
+        config.ZDICT_DIR = Path(tmp)
+        did = save_dict(train_dict(train))
+        codecs = [
+            ("none", BlobCodec("none", min_bytes=0)),
+            ("zlib-6", BlobCodec("zlib", level=6, zdict="", min_bytes=0)),
+            ("zlib-9", BlobCodec("zlib", level=9, zdict="", min_bytes=0)),
+            ("zlib+dict", BlobCodec("zlib", level=9, zdict=did, min_bytes=0)),
+            ("lzma", BlobCodec("lzma", min_bytes=0)),
+        ]
+        print(f"{len(test)} pages, avg {raw / len(test):.0f} B/page, dictionary {did}")
+        print(f"{'codec':>10} {'ratio':>7} {'encode MB/s':>12} {'decode us/page':>15}")
+        for name, c in codecs:
+            blobs = [c.encode(b) for b in test]
+            te = _time(lambda: [c.encode(b) for b in test], repeat)
+            td = _time(lambda: [c.decode(b) for b in blobs], repeat)
+            assert [c.decode(b) for b in blobs] == test
+            size = sum(len(b) for b in blobs)
+            print(f"{name:>10} {raw / size:>7.2f} {raw / te / 1e6:>12.1f} {td / len(test) * 1e6:>15.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="evidence_io benchmarks")
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--only", choices=("index", "codec", "compress"))
+    ap.add_argument("--codec-records", type=int, default=100_000)
+    args = ap.parse_args()
+    if args.only in (None, "index"):
+        bench_index([int(x) for x in args.sizes.split(",")], args.repeat)
+    if args.only in (None, "codec"):
+        bench_codec(args.codec_records, min(args.repeat, 5))
+    if args.only in (None, "compress"):
+        bench_compress(400, min(args.repeat, 5))
+
+
+if __name__ == "__main__":
+    main()
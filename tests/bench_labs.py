@@ -0,0 +1,92 @@
+from __future__ import annotations
+import argparse
+import random
+import re
+import time
+from typing import List
+
+from bot.lab_extract import Analyte, LabMatcher, load_catalog
+
+FILLER = (
+    "Пациент жалуется на слабость, анализы сданы натощак. "
+    "Results reviewed by the attending physician, no further comments. "
+)
+UNITS = ["г/л", "ммоль/л", "мкмоль/л", "%", "10^9/л", "U/L", "ng/mL", ""]
+LETTERS = "abcdefghijklmnopqrstuvwxyzабвгдежзиклмнопрстуфхцчшщэюя"
+
+
+def synthetic(n: int, rng: random.Random) -> List[Analyte]:
+    """Выдуманные анализы — посмотреть, как матчер ведёт себя на каталоге больше реального."""
+    return [
+        Analyte(f"synthetic_{i}", "synthetic", "", tuple(
+            "".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 12))) for _ in range(4)
+        ))
+        for i in range(n)
+    ]
+
+
+def make_text(catalog: List[Analyte], size_mb: float, rng: random.Random) -> str:
+    """Отчёт лаборатории: строки «синоним значение единица референс» вперемешку с прозой."""
+    parts: List[str] = []
+    n = 0
+    target = int(size_mb * 1024 * 1024)
+    while n < target:
+        a = rng.choice(catalog)
+        line = f"{rng.choice(a.synonyms)} {rng.uniform(0.1, 300):.1f} {rng.choice(list(a.units) or UNITS)} {rng.randint(1, 9)}-{rng.randint(10, 99)}. "
+        if rng.random() < 0.5:
+            line += FILLER
+        parts.append(line)
+        n += len(line.encode("utf-8"))
+    return "".join(parts)
+
+
+def per_pattern(catalog: List[Analyte]):
+    """Старый подход: отдельный regex и finditer на каждый анализ."""
+    value = r"\s*[:=]?\s*(\d+[\.,]?\d*)\b"
+    pats = [
+        (a.name, re.compile(r"\b(" + "|".join(re.escape(s) for s in a.synonyms) + ")" + value, re.I))
+        for a in catalog
+    ]
+
+    def scan(text: str) -> int:
+        return sum(1 for _, rx in pats for _ in rx.finditer(text))
+
+    return scan
+
+
+def mb_per_s(scan, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        scan(text)
+        best = min(best, time.perf_counter() - t0)
+    return len(text.encode("utf-8")) / 1024 / 1024 / best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Lab matcher throughput vs catalog size")
+    ap.add_argument("--mb", type=float, default=2.0)
+    ap.add_argument("--sizes", default="3,10,30,60,0,500,2000",
+                    help="число анализов; 0 — весь каталог, больше каталога — добивается синтетическими")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    full = load_catalog()
+    rng = random.Random(1)
+    text = make_text(full, args.mb, rng)
+    print(f"text: {len(text.encode('utf-8')) / 1024 / 1024:.1f} MB, catalog: {len(full)} analytes")
+    print(f"{'analytes':>8} {'synonyms':>8} {'hits':>7} {'single MB/s':>12} {'per-pattern MB/s':>17}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        catalog = full[:n] if n > 0 else full
+        if n > len(full):
+            catalog = full + synthetic(n - len(full), rng)
+        m = LabMatcher(catalog)
+        hits = len(m.scan(text))
+        single = mb_per_s(m.scan, text, args.repeat)
+        # per-pattern на синтетическом каталоге — минуты, не гоняем
+        old = f"{mb_per_s(per_pattern(catalog), text, args.repeat):.1f}" if n <= len(full) else "-"
+        print(f"{len(catalog):>8} {len(m.by_synonym):>8} {hits:>7} {single:>12.1f} {old:>17}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import difflib
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# config требует токены — для локального прогона они не нужны
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import pytesseract
+
+from bot import ocr
+from bot.ocr import OCR_LANG
+from bot.ocr_cache import OcrCache
+from bot.ocr_pool import OcrPool
+from bot.ocr_preprocess import Profile, prepare
+from bot.utils import normalize_text
+
+LINES = [
+    "Гемоглобин (HGB) 118 г/л 120-160",
+    "Лейкоциты (WBC) 11.2 10^9/л 4.0-9.0",
+    "С-реактивный белок (CRP) 26 мг/л 0-5",
+    "Креатинин (Creatinine) 94 мкмоль/л 62-106",
+    "Glucose 5.4 mmol/L 3.9-6.1",
+    "Ferritin 240 ng/mL 30-400",
+]
+
+
+def _font(size: int):
+    for name in ("DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def scanned_page(p: int, pages: int, dpi: int, rng: random.Random) -> Image.Image:
+    w, h = int(8.27 * dpi), int(11.69 * dpi)
+    font = _font(dpi // 6)
+    img = Image.new("L", (w, h), 255)
+    d = ImageDraw.Draw(img)
+    y = dpi // 2
+    d.text((dpi // 2, y), f"Лаборатория Здоровье — бланк {p + 1}/{pages}", fill=0, font=font)
+    for _ in range(24):
+        y += dpi // 4
+        d.text((dpi // 2, y), rng.choice(LINES), fill=0, font=font)
+    return img
+
+
+def make_scanned_pdf(path: Path, pages: int, dpi: int = 150, seed: int = 1) -> None:
+    """PDF только из картинок (без текстового слоя) — каждую страницу придётся OCR'ить."""
+    rng = random.Random(seed)
+    imgs = [scanned_page(p, pages, dpi, rng) for p in range(pages)]
+    imgs[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=imgs[1:])
+
+
+async def _pool_parse(pdf: Path, workers: int):
+    """Путь бота: OcrPool.parse_pdf, страницы — задачами в пуле процессов; кэш выключен."""
+    pool = OcrPool(workers=workers, page_workers=workers, cache=OcrCache(max_bytes=0))
+    try:
+        await pool.run(ocr.pdf_page_count, pdf)  # прогрев: запуск пула и импорты не входят в замер
+        t0 = time.perf_counter()
+        _, per_page = await pool.parse_pdf(pdf)
+        return time.perf_counter() - t0, per_page
+    finally:
+        await pool.close()
+
+
+def bench_parallel_pdf(pages: int, workers_list) -> None:
+    """OcrPool.parse_pdf на скан-PDF: время и ускорение против OCR_WORKERS = OCR_PAGE_WORKERS."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = Path(tmp) / "scan.pdf"
+        make_scanned_pdf(pdf, pages)
+        print(f"{pages}-page scanned PDF, {os.cpu_count()} CPUs")
+        print(f"{'workers':>8} {'seconds':>9} {'speedup':>8} {'same text':>10}")
+        base_t = base_text = None
+        for w in workers_list:
+            dt, per_page = asyncio.run(_pool_parse(pdf, w))
+            if base_t is None:
+                base_t, base_text = dt, per_page
+            print(f"{w:>8} {dt:>9.2f} {base_t / dt:>8.2f} {str(per_page == base_text):>10}")
+
+
+def make_photo(seed: int, dpi: int = 600, angle: float = 0.0) -> tuple[Image.Image, str]:
+    """«Фото бланка с телефона»: огромное, цветное, с наклоном и шумом. Возвращает (картинка, эталон)."""
+    rng = random.Random(seed)
+    w, h = int(8.27 * dpi), int(11.69 * dpi)
+    paper = (236 + rng.randint(-8, 8), 228 + rng.randint(-8, 8), 205 + rng.randint(-8, 8))
+    img = Image.new("RGB", (w, h), paper)
+    d = ImageDraw.Draw(img)
+    font = _font(dpi // 6)
+    lines = [rng.choice(LINES) for _ in range(18)]
+    y = dpi // 2
+    for line in lines:
+        d.text((dpi // 2, y), line, fill=(40, 40, 70), font=font)
+        y += dpi // 3
+    img = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=paper)
+    img = img.filter(ImageFilter.GaussianBlur(dpi / 400))
+    return img, normalize_text(" ".join(lines))
+
+
+def char_accuracy(expected: str, got: str) -> float:
+    return difflib.SequenceMatcher(None, expected, normalize_text(got), autojunk=False).ratio()
+
+
+PREP_PROFILES = {
+    "raw": None,
+    "gray+dpi300": Profile(target_dpi=300),
+    "gray+dpi200": Profile(target_dpi=200),
+    "+binarize": Profile(target_dpi=300, binarize=True),
+    "+deskew": Profile(target_dpi=300, deskew=True),
+    "+binarize+deskew": Profile(target_dpi=300, binarize=True, deskew=True),
+}
+
+
+def bench_preprocess(n: int) -> None:
+    """Время OCR (предобработка + tesseract) против посимвольной точности на синтетических фото."""
+    fixtures = [make_photo(seed, angle=(-3, 0, 1.5, 2.5)[seed % 4]) for seed in range(n)]
+    print(f"{n} synthetic phone photos ({fixtures[0][0].size[0]}x{fixtures[0][0].size[1]} RGB)")
+    print(f"{'profile':>18} {'s/image':>8} {'prep s':>7} {'accuracy':>9}")
+    for name, profile in PREP_PROFILES.items():
+        t_prep = t_total = acc = 0.0
+        for img, expected in fixtures:
+            t0 = time.perf_counter()
+            ready = img if profile is None else prepare(img, profile=profile)
+            t1 = time.perf_counter()
+            text = pytesseract.image_to_string(ready, lang=OCR_LANG)
+            t_total += time.perf_counter() - t0
+            t_prep += t1 - t0
+            acc += char_accuracy(expected, text)
+        print(f"{name:>18} {t_total / n:>8.2f} {t_prep / n:>7.2f} {acc / n:>9.3f}")
+
+
+def _line_image(text: str, dpi: int = 300) -> Image.Image:
+    font = _font(dpi // 6)
+    img = Image.new("L", (int(7.5 * dpi), dpi // 3), 255)
+    ImageDraw.Draw(img).text((dpi // 10, dpi // 20), text, fill=0, font=font)
+    return img
+
+
+def bench_engines(repeat: int) -> None:
+    """Задержка на страницу: pytesseract (процесс на вызов) против tesserocr (модель в памяти)."""
+    page = scanned_page(0, 1, 300, random.Random(1))
+    samples = {"line": [_line_image(LINES[i % len(LINES)]) for i in range(repeat)], "page": [page] * repeat}
+    print(f"{'engine':>12} {'sample':>7} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, make in ocr.ENGINES.items():
+        if name == "tesserocr" and ocr.tesserocr is None:
+            print(f"{name:>12}  (not installed, skipped)")
+            continue
+        engine = make()
+        for kind, imgs in samples.items():
+            times = []
+            for img in imgs:
+                t0 = time.perf_counter()
+                engine.image_to_string(img, "rus")
+                times.append((time.perf_counter() - t0) * 1000)
+            rest = sorted(times[1:]) or times
+            p95 = rest[min(len(rest) - 1, int(len(rest) * 0.95))]
+            print(f"{name:>12} {kind:>7} {times[0]:>9.1f} {rest[len(rest) // 2]:>8.1f} {p95:>8.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="OCR benchmarks")
+    ap.add_argument("--only", choices=["parallel", "preprocess", "engine"])
+    ap.add_argument("--pages", type=int, default=12)
+    ap.add_argument("--workers", default=",".join(str(w) for w in sorted({1, 2, 4, os.cpu_count() or 1})))
+    ap.add_argument("--photos", type=int, default=8)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+    if args.only in (None, "parallel"):
+        bench_parallel_pdf(args.pages, [int(x) for x in args.workers.split(",")])
+    if args.only in (None, "preprocess"):
+        bench_preprocess(args.photos)
+    if args.only in (None, "engine"):
+        bench_engines(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+
+# bot.config требует токены при импорте; тестам настоящие не нужны
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -1,14 +1,14 @@
 from __future__ import annotations
 import json
 from pathlib import Path
-from bot.config import settings
-from bot.evidence_io import Evidence, append_evidence
+from bot import config
+from bot.evidence_io import Evidence, append_evidence, iter_evidence
 from bot.handoff import quoted_evidence
 from bot.reviewer import analyze_case
 from bot.utils import now_iso
 
 CASES_DIR = Path("tests/cases")
-OUT_DIR = settings.compare_dir
+OUT_DIR = config.COMPARE_DIR
 
 
 def run_one(case_path: Path):
@@ -16,6 +16,7 @@ def run_one(case_path: Path):
     case_id = case["case_id"]
     user_id = case.get("user_id", 0)
 
+    started = now_iso()
     evs = []
     if txt := case["inputs"].get("text"):
         evs.append(Evidence(case_id, user_id, "patient_text", txt, {"type": "test"}, now_iso()))
@@ -23,7 +24,8 @@ def run_one(case_path: Path):
         evs.append(Evidence(case_id, user_id, "lab", labs, {"type": "test"}, now_iso()))
     append_evidence(evs)
 
-    quotes = quoted_evidence(evs)
+    # читаем обратно из хранилища — только записи этого прогона
+    quotes = quoted_evidence(iter_evidence(case_id, user_id, roles=("patient_text", "lab"), since=started))
     assessment = analyze_case(case_id, quotes)
 
     OUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from pathlib import Path
+
+# config требует токены — для локального прогона они не нужны
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "stress")
+os.environ.setdefault("OPENAI_API_KEY", "stress")
+
+
+def _writer(db: str, worker: int, batches: int, batch: int, frag_bytes: int) -> None:
+    from bot.evidence_io import Evidence, JsonlEvidenceStore
+    from bot.utils import now_iso
+
+    store = JsonlEvidenceStore(Path(db), read_mode="index")
+    # крупные строки (больше PIPE_BUF и буфера записи) — без блокировки они рвутся
+    frag = (f"w{worker} " + "Гемоглобин 120 г/л CRP 5 мг/л ") * (frag_bytes // 40)
+    for b in range(batches):
+        store.append([
+            Evidence(f"case_w{worker}", worker, "ocr", frag, {"type": "stress", "batch": b, "i": i}, now_iso())
+            for i in range(batch)
+        ])
+
+
+def run(workers: int, batches: int, batch: int, frag_bytes: int) -> int:
+    from bot.evidence_io import JsonlEvidenceStore, index_path_for
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Path(tmp) / "evidence.jsonl"
+        t0 = time.perf_counter()
+        procs = [mp.Process(target=_writer, args=(str(db), w, batches, batch, frag_bytes)) for w in range(workers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        dt = time.perf_counter() - t0
+
+        bad = total = 0
+        with db.open("rb") as f:
+            for line in f:
+                total += 1
+                try:
+                    json.loads(line)
+                except Exception:
+                    bad += 1
+        idx_lines = [json.loads(l) for l in index_path_for(db).read_text(encoding="utf-8").splitlines()]
+        dup = len(idx_lines) - len({(e[2], e[3]) for e in idx_lines})
+        store = JsonlEvidenceStore(db, read_mode="index")
+        per_case = [len(store.load(f"case_w{w}", w)) for w in range(workers)]
+
+        expected = batches * batch
+        ok = bad == 0 and dup == 0 and total == workers * expected and all(n == expected for n in per_case)
+        print(f"{workers} writers x {batches} batches x {batch} records "
+              f"({db.stat().st_size / 1e6:.1f} MB in {dt:.2f}s)")
+        print(f"lines={total} corrupted={bad} index_entries={len(idx_lines)} index_duplicates={dup} "
+              f"per_case={sorted(set(per_case))} -> {'OK' if ok else 'FAIL'}")
+        return 0 if ok else 1
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent multi-process evidence append stress test")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--batches", type=int, default=50)
+    ap.add_argument("--batch", type=int, default=4)
+    ap.add_argument("--frag-bytes", type=int, default=64 * 1024)
+    args = ap.parse_args()
+    raise SystemExit(run(args.workers, args.batches, args.batch, args.frag_bytes))
+
+
+if __name__ == "__main__":
+    main()
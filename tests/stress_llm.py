@@ -0,0 +1,170 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная заглушка Responses API: отвечает через --latency секунд.
+# Хендлеры бота раньше звали синхронный клиент прямо из event loop — ходы
+# интервью разных пользователей шли строго по одному; с AsyncOpenAI они
+# перекрываются, и пропускная способность растёт с числом одновременных диалогов.
+# requests/connections (накопительно) — сколько запросов обошлись без нового соединения.
+
+TURN = {"ask": "Когда это началось?", "explain": "", "summary": "", "red_flags": [], "urgent": False, "done": False}
+
+
+def _response(text: str) -> dict:
+    return {
+        "id": "resp_stub",
+        "object": "response",
+        "created_at": 0,
+        "model": "stub",
+        "status": "completed",
+        "output": [{
+            "type": "message",
+            "id": "msg_stub",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+    }
+
+
+FRIENDLY = "Спасибо, что подробно всё описали. " * 20
+
+
+def _sse(event: dict) -> bytes:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def start_stub(latency: float, chunks: int = 20) -> ThreadingHTTPServer:
+    """Заглушка /v1/responses; stream=true — SSE-дельты равными долями за то же время."""
+    body = json.dumps(_response(json.dumps(TURN, ensure_ascii=False))).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _stream(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            step = max(1, len(FRIENDLY) // chunks)
+            for seq, i in enumerate(range(0, len(FRIENDLY), step)):
+                time.sleep(latency / chunks)
+                self.wfile.write(_sse({
+                    "type": "response.output_text.delta", "item_id": "msg_stub", "output_index": 0,
+                    "content_index": 0, "delta": FRIENDLY[i:i + step], "sequence_number": seq, "logprobs": [],
+                }))
+                self.wfile.flush()
+            self.wfile.write(_sse({"type": "response.completed", "response": _response(FRIENDLY), "sequence_number": seq + 1}))
+
+        def do_POST(self):
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if req.get("stream"):
+                return self._stream()
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+async def _sync_turns(n: int, users: int) -> float:
+    """Как было: синхронный next_question прямо в корутине хендлера."""
+    from bot.interviewer import next_question
+
+    async def user():
+        for _ in range(n):
+            assert not next_question([{"role": "user", "content": "болит голова"}])["done"]
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    return time.perf_counter() - t0
+
+
+async def _async_turns(n: int, users: int) -> float:
+    from bot.interviewer import next_question_async
+
+    async def user():
+        for _ in range(n):
+            assert not (await next_question_async([{"role": "user", "content": "болит голова"}]))["done"]
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    return time.perf_counter() - t0
+
+
+async def _first_text(repeat: int) -> None:
+    """friendly_message целиком против стрима: когда пользователь видит первый текст."""
+    from bot.reviewer import friendly_message_async, friendly_message_stream
+
+    whole, first, total = [], [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await friendly_message_async({"summary": "stub"})
+        whole.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        seen = None
+        async for _delta in friendly_message_stream({"summary": "stub"}):
+            seen = seen or time.perf_counter() - t0
+        first.append(seen)
+        total.append(time.perf_counter() - t0)
+    med = lambda xs: sorted(xs)[len(xs) // 2] * 1000
+    print(f"friendly_message: whole {med(whole):.0f} ms; stream first text {med(first):.0f} ms, done {med(total):.0f} ms")
+
+
+async def _run(turns: int, users_list) -> None:
+    from bot import llm_http
+
+    # один event loop на весь прогон: асинхронный клиент держит соединения в нём
+    for users in users_list:
+        total = users * turns
+        # синхронный вариант линеен по числу ходов — на больших нагрузках его не гоняем
+        sync = f"{total / await _sync_turns(turns, users):.1f}" if users <= 4 else "-"
+        dt = await _async_turns(turns, users)
+        st = llm_http.stats()
+        print(f"{users:>6} {sync:>13} {total / dt:>14.1f} {st['requests']:>9} {st['connections']:>12}")
+    await _first_text(5)
+    await llm_http.aclose()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent interview turns against a local Responses API stub")
+    ap.add_argument("--latency", type=float, default=0.2, help="задержка заглушки, с")
+    ap.add_argument("--turns", type=int, default=5, help="ходов на пользователя")
+    ap.add_argument("--users", default="1,4,16,64")
+    ap.add_argument("--no-keepalive", action="store_true", help="соединение на запрос, как было до общего пула")
+    args = ap.parse_args()
+    if args.no_keepalive:
+        os.environ["LLM_MAX_KEEPALIVE"] = "0"
+
+    srv = start_stub(args.latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{srv.server_address[1]}/v1"
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "stress")
+    os.environ.setdefault("OPENAI_API_KEY", "stress")
+
+    print(f"stub latency {args.latency * 1000:.0f} ms, {args.turns} turns per user")
+    print(f"{'users':>6} {'sync turns/s':>13} {'async turns/s':>14} {'requests':>9} {'connections':>12}")
+    asyncio.run(_run(args.turns, [int(u) for u in args.users.split(",")]))
+    srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
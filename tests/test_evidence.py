@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+
+from bot import evidence_compact, evidence_io
+from bot.evidence_io import (
+    BlobStore, CachedEvidenceStore, DedupEvidenceStore, Evidence, FileLock, JsonlEvidenceStore,
+    SegmentedEvidenceStore, blob_key, get_index, index_path_for, snapshot_path_for,
+)
+
+
+class _Spy(JsonlEvidenceStore):
+    streamed = 0
+
+    def iter_case(self, *args, **kwargs):
+        self.streamed += 1
+        return super().iter_case(*args, **kwargs)
+
+
+def _ev(i: int, role: str = "ocr") -> Evidence:
+    return Evidence("c1", 1, role, f"fragment {i}", {"type": "t"}, f"2026-01-01T00:00:0{i}")
+
+
+def test_cold_index_loads_snapshot_then_idx_tail(tmp_path, monkeypatch):
+    db = tmp_path / "evidence.jsonl"
+    store = JsonlEvidenceStore(db)
+    monkeypatch.setattr(evidence_io, "SNAPSHOT_EVERY", 1)
+    store.append([_ev(0), _ev(1)])
+    monkeypatch.setattr(evidence_io, "SNAPSHOT_EVERY", 1 << 30)
+    store.append([_ev(2), Evidence("c2", 1, "ocr", "x", {"type": "t"}, "2026-01-01T00:00:03")])
+    assert snapshot_path_for(db).stat().st_mtime_ns <= index_path_for(db).stat().st_mtime_ns
+
+    idx = get_index(db)
+    warm = idx.lookup("c1", 1)
+    idx.forget()
+    assert idx.lookup("c1", 1) == warm and len(warm) == 3
+    assert idx.lookup("c2", 1) and idx._snap_pos < idx._idx_pos  # снимок + хвост .idx
+
+    index_path_for(db).write_bytes(b"")  # .idx обнулили — снимок дальше его конца не берём
+    idx.forget()
+    assert idx.lookup("c1", 1) == warm
+
+
+def test_cached_iter_case_fills_cache_on_miss(tmp_path):
+    inner = _Spy(tmp_path / "evidence.jsonl")
+    store = CachedEvidenceStore(inner, max_cases=4, ttl_s=0)
+    store.append([_ev(0), _ev(1, "lab"), _ev(2)])
+
+    assert [e.fragment for e in store.iter_case("c1", 1, roles={"ocr"})] == ["fragment 0", "fragment 2"]
+    got = [e.fragment for e in store.iter_case("c1", 1, since="2026-01-01T00:00:01")]
+    assert got == ["fragment 1", "fragment 2"]
+    assert inner.streamed == 1
+    assert (store.stats()["misses"], store.stats()["hits"]) == (1, 1)
+
+
+def test_abandoned_iter_case_is_not_cached(tmp_path):
+    store = CachedEvidenceStore(JsonlEvidenceStore(tmp_path / "evidence.jsonl"), max_cases=4, ttl_s=0)
+    store.append([_ev(0), _ev(1), _ev(2)])
+    next(store.iter_case("c1", 1))  # генератор брошен после первой записи
+    assert len(store.load("c1", 1)) == 3
+
+
+def test_full_text_by_page_references_resolves_through_cache(tmp_path):
+    store = CachedEvidenceStore(DedupEvidenceStore(JsonlEvidenceStore(tmp_path / "evidence.jsonl"),
+                                                   BlobStore(tmp_path / "blobs")), max_cases=4, ttl_s=0)
+    pages = ["страница один " * 30, "страница два " * 30]
+    src = {"type": "upload", "sha256": "x"}
+    store.append([Evidence("c1", 1, "ocr", t, {**src, "page": i + 1}, "2026-01-01T00:00:00")
+                  for i, t in enumerate(pages)])
+    store.load("c1", 1)  # дело уже в кэше, когда приходит запись со ссылками
+    store.append([Evidence("c1", 1, "ocr", "", {**src, "parts": [blob_key(t) for t in pages]}, "2026-01-01T00:00:01")])
+
+    full = [e for e in store.iter_case("c1", 1) if "parts" in e.source]
+    assert [e.fragment for e in full] == [" ".join(p.strip() for p in pages)]
+
+
+def test_compaction_drops_noise_and_orphaned_cases_and_their_files(tmp_path):
+    store = SegmentedEvidenceStore(tmp_path / "segments", max_bytes=0, max_age_s=0)
+    ts = "2026-01-01T00:00:00"
+    store.append([
+        Evidence("a", 1, "patient_text", "болит голова", {"type": "answer"}, ts),
+        Evidence("a", 1, "lab", "glucose: 5.4", {"type": "lab_extract"}, ts),
+        Evidence("b", 1, "lab", "glucose: 9.1", {"type": "lab_extract"}, ts),    # сирота
+        Evidence("c", 1, "patient_text", "/review c", {"type": "answer"}, ts),   # шум
+        Evidence("d", 1, "lab", "glucose: 7.0", {"type": "lab_extract"}, ts),    # текст — в активном
+    ])
+    sealed = store.manifest["active"]
+    store.rotate()
+    store.append([Evidence("d", 1, "ocr", "Glucose 7.0 mmol/L", {"type": "upload", "page": 1}, ts)])
+
+    stats = store.compact()
+    assert (stats["cases_dropped"], stats["cases_orphaned"]) == (1, 1)
+    assert [e.role for e in store.load("a", 1)] == ["patient_text", "lab"]
+    assert store.load("b", 1) == [] and store.load("c", 1) == []
+    assert [e.role for e in store.load("d", 1)] == ["lab", "ocr"]
+    assert not list((tmp_path / "segments").glob(sealed + "*"))  # ни лога, ни .idx, ни .lock
+
+
+def test_lock_waiter_relocks_file_unlinked_by_holder(tmp_path):
+    path = tmp_path / "seg.lock"
+    held, waiter = FileLock(path), FileLock(path)
+    got = []
+
+    def wait():
+        with waiter:
+            got.append(os.fstat(waiter._fd).st_ino == os.stat(path).st_ino)
+
+    with held:
+        t = threading.Thread(target=wait)
+        t.start()
+        t.join(0.2)
+        assert t.is_alive()  # ждёт flock на старом файле
+        held.unlink()
+    t.join(5)
+    assert got == [True]
+
+
+def test_compact_cli_rotates_and_compacts(tmp_path, capsys):
+    root = tmp_path / "segments"
+    SegmentedEvidenceStore(root).append([
+        Evidence("a", 1, "patient_text", "болит голова", {"type": "answer"}, "2026-01-01T00:00:00"),
+        Evidence("a", 1, "patient_text", "/review a", {"type": "answer"}, "2026-01-01T00:00:01"),
+    ])
+    evidence_compact.main(["--dir", str(root), "--rotate"])
+    stats = json.loads(capsys.readouterr().out)
+    assert (stats["segments_in"], stats["records_in"], stats["records_out"]) == (1, 2, 1)
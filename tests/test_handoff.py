@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from bot.evidence_io import Evidence
+from bot.handoff import QUOTE_LIMIT, quoted_evidence
+
+
+def _ev(text: str) -> Evidence:
+    return Evidence("c1", 1, "ocr", text, {"type": "pdf_text"}, "2026-01-01T00:00:00")
+
+
+def test_dedupe_skips_repeated_and_identically_truncated_fragments():
+    head = "Выписка. " * (QUOTE_LIMIT // 9 + 1)
+    quotes = quoted_evidence([_ev(head + "диагноз А"), _ev(head + "диагноз Б"), _ev(head + "диагноз А"),
+                              _ev("диагноз А")])
+    assert quotes == [head[:QUOTE_LIMIT - 3] + "…", "диагноз А"]
+
+
+def test_multi_page_pdf_full_text_does_not_repeat_first_page():
+    pages = ["Страница первая. " * 30, "Страница вторая. " * 30]
+    src = {"type": "upload", "sha256": "x"}
+    evs = [Evidence("c1", 1, "ocr", t, {**src, "page": i + 1}, "2026-01-01T00:00:00")
+           for i, t in enumerate(pages)]
+    evs.append(Evidence("c1", 1, "ocr", " ".join(p.strip() for p in pages),
+                        {**src, "parts": ["p1", "p2"]}, "2026-01-01T00:00:01"))
+    quotes = quoted_evidence(evs)
+    assert len(quotes) == len(set(quotes)) == 2
+    assert [q[:16] for q in quotes] == ["Страница первая.", "Страница вторая."]
+
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from bot.lab_extract import LabRow, matcher, parse_table
+from bot.lab_norm import normalize, summary
+
+
+def test_table_keeps_qualitative_rows():
+    rows = parse_table([
+        ["Показатель", "Результат", "Ед.", "Референс"],
+        ["Биохимия", None, None, None],
+        ["Гемоглобин", "118", "г/л", "120-160"],
+        ["HBsAg", "положительно", "", "отрицательно"],
+    ], page=1)
+    assert [(r.analyte, r.value) for r in rows] == [("Гемоглобин", "118"), ("HBsAg", "положительно")]
+    lines = summary(normalize(rows)).splitlines()
+    assert "HBsAg: положительно (ref отрицательно)" in lines
+
+
+def _hits(text):
+    return [(h.analyte, h.value, h.unit) for h in matcher().scan(text)]
+
+
+def test_matcher_skips_doses_and_foreign_units():
+    assert _hits("Витамин D 2000 МЕ ежедневно") == []
+    assert _hits("Глюкоза 5 мг/сут") == []
+    assert _hits("Витамин D 24 нг/мл") == [("vitamin_d", "24", "нг/мл")]
+    assert _hits("Глюкоза 5.4 натощак") == [("glucose", "5.4", "")]
+
+
+def test_short_names_need_their_unit():
+    assert _hits("кабинет K 12, затем Ca 3") == []
+    assert _hits("ПВ 14 пациенту назначен") == []
+    assert _hits("K 4.5 ммоль/л, Ca 2.3 ммоль/л") == [("potassium", "4.5", "ммоль/л"), ("calcium", "2.3", "ммоль/л")]
+
+
+def test_value_without_unit_is_not_flagged_against_catalog():
+    res = {r.analyte: r for r in normalize([
+        LabRow("Витамин D", "2000"),       # доза, не результат
+        LabRow("Гемоглобин", "12"),        # номер палаты
+        LabRow("Глюкоза", "7.2", "", "3.9-6.1"),
+    ])}
+    assert res["vitamin_d"].flag == "" and res["hemoglobin"].flag == ""
+    assert res["vitamin_d"].compact() == "vitamin_d: 2000"
+    assert res["glucose"].flag == "H"  # референс бланка есть — сравниваем как есть
+
+
+def test_power_unit_spellings():
+    assert _hits("WBC 7.2 x10^9/L") == [("wbc", "7.2", "x10^9/L")]
+    assert _hits("Лейкоциты 7.2 ×10^9/л") == [("wbc", "7.2", "×10^9/л")]
+    assert _hits("PLT 250 10⁹/л") == [("platelets", "250", "10⁹/л")]
+    assert _hits("Тромбоциты 250 *10^9/л") == [("platelets", "250", "*10^9/л")]
+    res = normalize([LabRow("WBC", "11.2", "х10^9/л")])
+    assert (res[0].unit, res[0].flag) == ("10^9/L", "H")
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from PIL import Image
+
+from bot import ocr_lang
+
+RU = "Общий анализ крови пациента, повторный забор не требуется. " * 3
+
+
+def _osd(img):
+    raise AssertionError("OSD не должен вызываться для страниц без текстового слоя")
+
+
+def test_scanned_page_keeps_combined_model():
+    assert ocr_lang.choose(Image.new("L", (10, 10)), _osd, "") is None
+
+
+def test_text_layer_narrows_only_single_script():
+    img = Image.new("L", (10, 10))
+    assert ocr_lang.choose(img, _osd, RU) == "rus"
+    assert ocr_lang.choose(img, _osd, RU + "WBC ALT mmol/L") is None
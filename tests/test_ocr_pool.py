@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from bot.ocr_cache import OcrCache
+from bot.ocr_pool import OcrPool
+
+
+def _die() -> None:
+    os.kill(os.getpid(), signal.SIGKILL)  # как OOM-killer на большом скане
+
+
+def test_pool_restarts_after_worker_death():
+    async def go():
+        pool = OcrPool(workers=1, page_workers=1, cache=OcrCache(max_bytes=0))
+        try:
+            with pytest.raises(BrokenProcessPool):
+                await pool.run(_die)
+            assert await pool.run(os.getpid) != os.getpid()
+            assert pool.restarts == 1 and pool.pending == 0
+        finally:
+            await pool.close()
+
+    asyncio.run(go())